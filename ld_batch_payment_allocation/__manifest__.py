@@ -2,16 +2,23 @@
 {
     "name": "LD Batch Payment Allocation",
     "summary": "Allocate a payment across multiple invoices with per-line amounts.",
-    "version": "19.0.33",
+    "version": "19.0.42",
     "category": "Accounting/Accounting",
     "author": "FenixCR Solutions",
     "license": "LGPL-3",
     "depends": ["account"],
     "data": [
         "security/ir.model.access.csv",
+        "security/batch_payment_security.xml",
         "views/menu.xml",
         "views/batch_payment_wizard_views.xml",
         "views/batch_payment_unreconciled_views.xml",
+        "views/batch_payment_run_views.xml",
+        "views/batch_payment_allocation_job_views.xml",
+        "views/batch_payment_query_diagnosis_views.xml",
+        "views/batch_payment_remittance_import_views.xml",
+        "views/batch_payment_perf_log_views.xml",
+        "data/ir_cron.xml",
         "data/diagnose_views.xml"
     ],
     "application": False,
@@ -0,0 +1,7 @@
+from . import account_move
+from . import account_payment
+from . import batch_payment_processing
+from . import batch_payment_run
+from . import batch_payment_allocation_job
+from . import batch_payment_query_diagnosis
+from . import batch_payment_perf_log
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+from odoo.tools.sql import create_index
+
+# Indexes serving the allocation wizard's hot domains: {index name: (table, columns, where)}
+BATCH_PAYMENT_INDEXES = {
+    # _get_invoice_domain: open invoices of a partner, ordered by invoice_date, name
+    "ld_batch_payment_open_invoice_idx": (
+        "account_move",
+        ["partner_id", "company_id", "move_type", "invoice_date", "name"],
+        "state = 'posted' AND payment_state IN ('not_paid', 'partial')",
+    ),
+    # _get_credit_domain / residual reads: unreconciled items of a partner per account
+    "ld_batch_payment_open_item_idx": (
+        "account_move_line",
+        ["partner_id", "company_id", "reconciled", "account_id"],
+        "",
+    ),
+}
+
+
+def _create_batch_payment_indexes(cr, table):
+    for name, (tablename, expressions, where) in BATCH_PAYMENT_INDEXES.items():
+        if tablename == table:
+            create_index(cr, name, tablename, expressions, where=where)
+
+
+class AccountMove(models.Model):
+    _inherit = "account.move"
+
+    def init(self):
+        super().init()
+        _create_batch_payment_indexes(self.env.cr, self._table)
+
+
+class AccountMoveLine(models.Model):
+    _inherit = "account.move.line"
+
+    def init(self):
+        super().init()
+        _create_batch_payment_indexes(self.env.cr, self._table)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models
+
+# Context key carrying the allocation wizard's key down to the payments it creates
+BATCH_ALLOCATION_KEY = "batch_allocation_key"
+# Context key carrying (payment currency id, custom rate) of an allocation paying at a custom rate
+BATCH_CUSTOM_RATE_KEY = "batch_allocation_custom_rate"
+
+
+class AccountPayment(models.Model):
+    _inherit = "account.payment"
+
+    batch_allocation_key = fields.Char(
+        string="Batch Allocation Key", readonly=True, copy=False, index="btree_not_null",
+        help="Key of the batch payment allocation that created this payment.",
+    )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        key = self.env.context.get(BATCH_ALLOCATION_KEY)
+        if key:
+            for vals in vals_list:
+                vals.setdefault("batch_allocation_key", key)
+        custom_rate = self.env.context.get(BATCH_CUSTOM_RATE_KEY)
+        if custom_rate:
+            currency_id, rate = custom_rate
+            for vals in vals_list:
+                company = self.env["res.company"].browse(vals.get("company_id")) or self.env.company
+                if vals.get("currency_id") == currency_id and company.currency_id.id != currency_id:
+                    # Book the payment at the custom rate (1 company currency = rate payment currency)
+                    vals.setdefault("force_balance", company.currency_id.round((vals.get("amount") or 0.0) / rate))
+        return super().create(vals_list)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models, _
+from odoo.exceptions import AccessError
+
+from ..wizards.batch_payment_wizard import ALLOCATION_MODES, CREDIT_MATCHINGS, PARTNER_TYPES, RATE_SOURCES
+
+
+class BatchPaymentAllocationJob(models.Model):
+    _name = "batch.payment.allocation.job"
+    _inherit = ["batch.payment.processing.mixin"]
+    _description = "Batch Payment Allocation Job (Background)"
+    _order = "id desc"
+
+    _cron_xmlid = "ld_batch_payment_allocation.ir_cron_batch_payment_allocation_job"
+
+    name = fields.Char(required=True, readonly=True, copy=False)
+    job_type = fields.Selection([("allocate", "Generate Payments"), ("apply_credits", "Apply Credits/Payments")],
+                                required=True, readonly=True, default="allocate")
+    state = fields.Selection([("pending", "Pending"), ("running", "Running"), ("done", "Done"), ("failed", "Failed")],
+                             default="pending", required=True, readonly=True, copy=False)
+    company_id = fields.Many2one("res.company", required=True, readonly=True, default=lambda self: self.env.company)
+    user_id = fields.Many2one("res.users", string="Requested By", readonly=True, default=lambda self: self.env.user,
+                              help="The job pays with this user's access rights; always the user who created it.")
+
+    # Snapshot of the wizard settings
+    partner_type = fields.Selection(PARTNER_TYPES, required=True, readonly=True)
+    partner_id = fields.Many2one("res.partner", string="Partner", required=True, readonly=True)
+    journal_id = fields.Many2one("account.journal", string="Payment Journal", readonly=True)
+    payment_method_line_id = fields.Many2one("account.payment.method.line", string="Payment Method", readonly=True)
+    payment_date = fields.Date(readonly=True)
+    communication = fields.Char(string="Memo / Reference", readonly=True)
+    allocation_mode = fields.Selection(ALLOCATION_MODES, readonly=True, string="Allocation Mode")
+    rate_source = fields.Selection(RATE_SOURCES, default="company", readonly=True, string="FX Rate Source")
+    custom_rate = fields.Float(string="Custom Rate (1 Company CCY -> Payment CCY)", digits=(16, 6), readonly=True)
+    credit_matching = fields.Selection(CREDIT_MATCHINGS, string="Credit Matching", default="fifo", readonly=True)
+    invoice_move_ids = fields.Many2many("account.move", string="Invoices", readonly=True,
+                                        help="Invoices receiving the credits, oldest first.")
+
+    chunk_size = fields.Integer(string="Lines per Chunk", default=100, required=True)
+    line_ids = fields.One2many("batch.payment.allocation.job.line", "job_id", string="Lines", readonly=True)
+    payment_ids = fields.Many2many("account.payment", string="Payments", readonly=True, copy=False)
+    payment_count = fields.Integer(compute="_compute_payment_count")
+
+    # Progress, kept as plain counters so polling never reads the lines
+    total_count = fields.Integer(string="Total", readonly=True)
+    processed_count = fields.Integer(string="Processed", readonly=True, copy=False)
+    date_start = fields.Datetime(string="Started", readonly=True, copy=False)
+    date_end = fields.Datetime(string="Finished", readonly=True, copy=False)
+    progress = fields.Float(compute="_compute_progress")
+    elapsed = fields.Float(string="Elapsed (s)", compute="_compute_progress")
+    eta = fields.Float(string="ETA (s)", compute="_compute_progress")
+
+    @api.depends("payment_ids")
+    def _compute_payment_count(self):
+        for job in self:
+            job.payment_count = len(job.payment_ids)
+
+    @api.depends("total_count", "processed_count", "date_start", "date_end")
+    def _compute_progress(self):
+        now = fields.Datetime.now()
+        for job in self:
+            job.progress = 100.0 * job.processed_count / job.total_count if job.total_count else 0.0
+            elapsed = ((job.date_end or now) - job.date_start).total_seconds() if job.date_start else 0.0
+            job.elapsed = elapsed
+            remaining = job.total_count - job.processed_count
+            job.eta = elapsed / job.processed_count * remaining if job.processed_count and remaining > 0 else 0.0
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if not vals.get("name"):
+                vals["name"] = _("Allocation Job %s", fields.Datetime.now())
+            vals["total_count"] = len(vals.get("line_ids") or [])
+            # The cron pays as this user: never take it from the caller
+            vals["user_id"] = self.env.uid
+        jobs = super().create(vals_list)
+        jobs._trigger_cron()
+        return jobs
+
+    def write(self, vals):
+        if "user_id" in vals and not self.env.su:
+            raise AccessError(_("The user of an allocation job cannot be changed."))
+        return super().write(vals)
+
+    def _prepare_wizard_vals(self):
+        self.ensure_one()
+        return dict(
+            self.env["batch.payment.allocation.wizard"]._prepare_settings_vals(self, self.partner_id),
+            rate_source=self.rate_source,
+            custom_rate=self.custom_rate,
+            credit_matching=self.credit_matching,
+        )
+
+    # ---------- actions ----------
+    def action_retry(self):
+        """Requeue failed jobs; lines already done are never processed again."""
+        for job in self.filtered(lambda j: j.state == "failed"):
+            failed_lines = job.line_ids.filtered(lambda l: l.state == "failed")
+            failed_lines.state = "pending"
+            job.write({
+                "state": "pending",
+                "error": False,
+                "processed_count": job.processed_count - len(failed_lines),
+            })
+        self._trigger_cron()
+        return True
+
+    def _action_open(self):
+        self.ensure_one()
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "views": [(False, "form")],
+            "target": "current",
+        }
+
+    def _get_processed_payments(self):
+        return self.payment_ids
+
+    # ---------- processing ----------
+    @api.model
+    def _cron_process_jobs(self):
+        """Process pending jobs, see ``_cron_process``.
+
+        A job line is marked done in the same transaction as its payment, so a
+        chunk interrupted by a crash is rolled back as a whole and retried
+        without paying any invoice twice.
+        """
+        self._cron_process()
+
+    def _get_processing_domain(self):
+        return [("state", "in", ("pending", "running"))]
+
+    def _start_processing(self):
+        if self.state == "pending":
+            self.write({"state": "running", "date_start": fields.Datetime.now()})
+            self._commit()
+
+    def _finish_processing(self):
+        super()._finish_processing()
+        self.date_end = fields.Datetime.now()
+
+    def _process_chunk(self, lines):
+        self.ensure_one()
+        wizard = self.env["batch.payment.allocation.wizard"].with_user(self.user_id).with_company(self.company_id)\
+            .create(self._prepare_wizard_vals())
+        if self.job_type == "apply_credits":
+            residuals = {line.id: line.aml_id.amount_residual for line in lines}
+            applied, failed = wizard._apply_credits(
+                lines.aml_id, self.invoice_move_ids.sorted(lambda m: (m.invoice_date or False, m.name or "")))
+            lines.aml_id.invalidate_recordset(["amount_residual", "reconciled"])
+            used = lines.filtered(
+                lambda l: l.aml_id.company_currency_id.compare_amounts(l.aml_id.amount_residual, residuals[l.id]))
+            used.write({"state": "done"})
+            # Untouched credits had no invoice left, or their reconciliation failed
+            (lines - used).write({"state": "failed" if failed else "skipped"})
+            if failed:
+                self.error = _("%(applied)s credit assignments were applied, %(failed)s could not be reconciled.",
+                               applied=applied, failed=failed)
+        else:
+            wizard._check_allocation_settings()
+            date = self.payment_date or fields.Date.context_today(self)
+            items = [(line.move_id, None if line.pay_full_residual else line.amount) for line in lines]
+            allocations = wizard._clamp_to_residual_paycur(items, date=date)
+            payments = wizard._allocate(allocations, date)
+            paid = {move.id for move, amt_paycur, _res in allocations if amt_paycur > 0}
+            # Invoices already settled meanwhile are clamped to zero and skipped
+            lines.filtered(lambda l: l.move_id.id in paid).write({"state": "done"})
+            lines.filtered(lambda l: l.move_id.id not in paid).write({"state": "skipped"})
+            self.payment_ids = [(4, pid) for pid in payments.ids]
+        self.processed_count += len(lines)
+
+
+class BatchPaymentAllocationJobLine(models.Model):
+    _name = "batch.payment.allocation.job.line"
+    _description = "Batch Payment Allocation Job Line"
+    _order = "job_id, id"
+
+    job_id = fields.Many2one("batch.payment.allocation.job", required=True, ondelete="cascade", index=True)
+    move_id = fields.Many2one("account.move", string="Invoice", readonly=True)
+    aml_id = fields.Many2one("account.move.line", string="Outstanding Item", readonly=True)
+    amount = fields.Float(string="Amount to Pay", readonly=True)
+    pay_full_residual = fields.Boolean(string="Full Residual", readonly=True)
+    state = fields.Selection([("pending", "Pending"), ("done", "Done"), ("skipped", "Skipped"), ("failed", "Failed")],
+                             default="pending", required=True, readonly=True, index=True)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import functools
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from odoo import api, fields, models, _
+from odoo.tools import str2bool
+
+_logger = logging.getLogger(__name__)
+
+PERF_LOG_PARAM = "ld_batch_payment_allocation.perf_log"
+PERF_CONTEXT_KEY = "batch_payment_perf_recorder"
+PERF_LOG_RETENTION_DAYS = 30
+
+
+class PerfPhase:
+    """Handle yielded by a timed phase; the caller may set ``line_count``."""
+    __slots__ = ("line_count",)
+
+    def __init__(self):
+        self.line_count = 0
+
+
+class PerfRecorder:
+    """Per-phase wall time, SQL query and line counts of one wizard operation.
+
+    Phases with the same name are accumulated (e.g. one reconciliation per
+    account). Phases are leaves: they must not be nested.
+    """
+
+    def __init__(self, cr):
+        self.cr = cr
+        self.phases = {}
+        self.start = time.perf_counter()
+        self.start_queries = cr.sql_log_count
+
+    @contextmanager
+    def phase(self, name):
+        handle = PerfPhase()
+        start, queries = time.perf_counter(), self.cr.sql_log_count
+        yield handle
+        duration, query_count, line_count = self.phases.get(name, (0.0, 0, 0))
+        self.phases[name] = (
+            duration + time.perf_counter() - start,
+            query_count + self.cr.sql_log_count - queries,
+            max(line_count, handle.line_count),
+        )
+
+    def total(self):
+        return (time.perf_counter() - self.start, self.cr.sql_log_count - self.start_queries,
+                max((lines for _d, _q, lines in self.phases.values()), default=0))
+
+
+@contextmanager
+def _disabled_phase():
+    yield PerfPhase()
+
+
+def perf_phase(records, name):
+    """Time ``name`` when ``records`` run inside a logged operation, else do nothing."""
+    recorder = records.env.context.get(PERF_CONTEXT_KEY)
+    return recorder.phase(name) if recorder else _disabled_phase()
+
+
+def perf_logged(operation):
+    """Log the phases of the decorated wizard method when the perf log is enabled.
+
+    When disabled, the only cost is one cached system parameter lookup. Calls
+    nested in an already logged operation add their phases to it.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            PerfLog = self.env["batch.payment.perf.log"]
+            if PERF_CONTEXT_KEY in self.env.context or not PerfLog._is_enabled():
+                return method(self, *args, **kwargs)
+            recorder = PerfRecorder(self.env.cr)
+            try:
+                result = method(self.with_context(**{PERF_CONTEXT_KEY: recorder}), *args, **kwargs)
+            except Exception:
+                # The transaction is lost; keep the phases in the server log
+                _logger.warning("Batch payment %s failed after %.3f s, phases: %s",
+                                operation, recorder.total()[0], recorder.phases)
+                raise
+            PerfLog._log_operation(operation, self, recorder)
+            return result
+        return wrapper
+    return decorator
+
+
+class BatchPaymentPerfLog(models.Model):
+    _name = "batch.payment.perf.log"
+    _description = "Batch Payment Performance Log"
+    _order = "id desc"
+
+    name = fields.Char(string="Run", required=True, readonly=True)
+    run_key = fields.Char(required=True, readonly=True, index=True)
+    operation = fields.Selection([
+        ("load", "Load Invoices"),
+        ("allocate", "Generate Payment"),
+        ("apply_credits", "Apply Credits"),
+    ], required=True, readonly=True)
+    phase = fields.Char(required=True, readonly=True)
+    duration = fields.Float(string="Duration (s)", digits=(16, 3), readonly=True, aggregator="sum")
+    query_count = fields.Integer(string="Queries", readonly=True, aggregator="sum")
+    line_count = fields.Integer(string="Lines", readonly=True, aggregator="max")
+    partner_id = fields.Many2one("res.partner", readonly=True)
+    user_id = fields.Many2one("res.users", readonly=True)
+    company_id = fields.Many2one("res.company", readonly=True)
+
+    @api.model
+    def _is_enabled(self):
+        return str2bool(self.env["ir.config_parameter"].sudo().get_param(PERF_LOG_PARAM, "False"), False)
+
+    @api.model
+    def _log_operation(self, operation, wizards, recorder):
+        """Store one row per phase plus a ``total`` row for the operation."""
+        wizard = wizards[:1]
+        label = dict(self._fields["operation"]._description_selection(self.env))[operation]
+        name = "%s - %s - %s" % (label, wizard.partner_id.display_name or "", fields.Datetime.now())
+        common = {
+            "name": name,
+            "run_key": uuid.uuid4().hex,
+            "operation": operation,
+            "partner_id": wizard.partner_id.id,
+            "user_id": self.env.uid,
+            "company_id": (wizard.company_id or self.env.company).id,
+        }
+        phases = list(recorder.phases.items()) + [("total", recorder.total())]
+        self.sudo().create([dict(common, phase=phase, duration=duration, query_count=query_count, line_count=line_count)
+                            for phase, (duration, query_count, line_count) in phases])
+
+    @api.autovacuum
+    def _gc_perf_logs(self):
+        limit = fields.Datetime.now() - timedelta(days=PERF_LOG_RETENTION_DAYS)
+        self.sudo().search([("create_date", "<", limit)]).unlink()
+
+    @api.model
+    def _action_slowest_runs(self, limit=20):
+        """Open the phases of the ``limit`` slowest logged runs, one pivot row per run."""
+        totals = self.search([("phase", "=", "total")], order="duration desc", limit=limit)
+        return {
+            "type": "ir.actions.act_window",
+            "name": _("Slowest Batch Payment Runs"),
+            "res_model": self._name,
+            "view_mode": "pivot,list",
+            "views": [(False, "pivot"), (False, "list")],
+            "domain": [("run_key", "in", totals.mapped("run_key")), ("phase", "!=", "total")],
+            "context": {
+                "pivot_row_groupby": ["name"],
+                "pivot_column_groupby": ["phase"],
+                "pivot_measures": ["duration", "query_count"],
+            },
+        }
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class BatchPaymentProcessingMixin(models.AbstractModel):
+    """Chunked background processing shared by payment runs and allocation jobs.
+
+    Inheriting models have ``state``, ``chunk_size`` and ``line_ids`` (lines
+    with a pending/done/failed ``state``) and pay a chunk of lines in
+    ``_process_chunk(lines)``.
+    """
+    _name = "batch.payment.processing.mixin"
+    _description = "Batch Payment Background Processing"
+
+    # Seconds a single cron execution may spend before re-triggering itself
+    _cron_time_budget = 240
+    # XML id of the cron processing the records of the inheriting model
+    _cron_xmlid = None
+
+    error = fields.Text(readonly=True, copy=False)
+
+    def _commit(self):
+        """Commit the chunk just processed, except in tests where the test transaction must survive."""
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
+
+    def _trigger_cron(self):
+        self.env.ref(self._cron_xmlid).sudo()._trigger()
+
+    def _get_processed_payments(self):
+        """Payments created by the processing of ``self``."""
+        return self.env["account.payment"]
+
+    def action_open_payments(self):
+        self.ensure_one()
+        return self.env["batch.payment.allocation.wizard"]._action_open_payments(self._get_processed_payments())
+
+    # ---------- processing ----------
+    def _get_processing_domain(self):
+        return [("state", "=", "running")]
+
+    def _get_pending_chunk(self):
+        self.ensure_one()
+        return self.line_ids.filtered(lambda l: l.state == "pending")[:max(self.chunk_size, 1)]
+
+    def _start_processing(self):
+        """Called before the first chunk of each cron execution."""
+
+    def _finish_processing(self):
+        """Called once no line is pending anymore."""
+        self.state = "failed" if any(l.state == "failed" for l in self.line_ids) else "done"
+
+    def _fail_processing(self, lines, error):
+        """Called when processing the chunk ``lines`` raised ``error``; the chunk is rolled back."""
+        self.write({"state": "failed", "error": str(error)})
+
+    @api.model
+    def _cron_process(self):
+        """Process the records to process chunk by chunk, committing after each chunk.
+
+        A chunk interrupted by an error is rolled back as a whole and the
+        record fails; one interrupted by a crash or a timeout is retried by
+        the next execution. Out of time, the cron triggers itself again.
+        """
+        deadline = time.monotonic() + self._cron_time_budget
+        for record in self.search(self._get_processing_domain(), order="id asc"):
+            record._start_processing()
+            while time.monotonic() < deadline:
+                lines = record._get_pending_chunk()
+                if not lines:
+                    record._finish_processing()
+                    record._commit()
+                    break
+                try:
+                    with self.env.cr.savepoint():
+                        record._process_chunk(lines)
+                except Exception as e:
+                    _logger.exception("Batch payment processing of %s failed", record)
+                    record._fail_processing(lines, e)
+                    record._commit()
+                    break
+                record._commit()
+            else:
+                # Out of time: continue in a fresh cron execution
+                record._trigger_cron()
+                return
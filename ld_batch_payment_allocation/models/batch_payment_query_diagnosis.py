@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import json
+
+from odoo import api, fields, models, _
+from odoo.tools import SQL
+from odoo.tools.sql import index_exists
+
+from ..wizards.batch_payment_wizard import RECEIVABLE_PAYABLE
+from .account_move import BATCH_PAYMENT_INDEXES
+
+
+class BatchPaymentQueryDiagnosis(models.TransientModel):
+    _name = "batch.payment.query.diagnosis"
+    _description = "Batch Payment Query Plan Diagnosis"
+    _order = "duration_ms desc"
+
+    name = fields.Char(string="Query", readonly=True)
+    model = fields.Char(readonly=True)
+    domain = fields.Text(readonly=True)
+    duration_ms = fields.Float(string="Execution (ms)", digits=(16, 3), readonly=True)
+    planning_ms = fields.Float(string="Planning (ms)", digits=(16, 3), readonly=True)
+    rows = fields.Integer(readonly=True)
+    index_names = fields.Char(string="Indexes Used", readonly=True)
+    seq_scans = fields.Char(string="Sequential Scans", readonly=True)
+    missing_indexes = fields.Char(string="Missing Module Indexes", readonly=True)
+    plan = fields.Text(readonly=True)
+
+    @api.model
+    def _get_sample_partner(self, move_types):
+        """The commercial partner with the most open invoices: the worst case for the wizard."""
+        groups = self.env["account.move"]._read_group([
+            ("move_type", "in", move_types),
+            ("state", "=", "posted"),
+            ("payment_state", "in", ("not_paid", "partial")),
+            ("company_id", "=", self.env.company.id),
+        ], groupby=["partner_id"], aggregates=["__count"], order="__count desc", limit=1)
+        return groups[0][0] if groups else self.env["res.partner"]
+
+    @api.model
+    def _get_diagnosed_queries(self):
+        """Return (label, model, domain, order) for the domains the wizard actually runs."""
+        queries = []
+        for partner_type, move_types in (("customer", ("out_invoice",)), ("supplier", ("in_invoice",))):
+            partner = self._get_sample_partner(move_types)
+            if not partner:
+                continue
+            wizard = self.env["batch.payment.allocation.wizard"].new({
+                "partner_type": partner_type,
+                "partner_id": partner.id,
+                "company_id": self.env.company.id,
+            })
+            invoice_domain = wizard._get_invoice_domain()
+            moves = self.env["account.move"].search(invoice_domain, limit=wizard.page_size or None, order=wizard._invoice_order)
+            queries += [
+                (_("Open invoices (%s)", partner.display_name), "account.move", invoice_domain, wizard._invoice_order),
+                (_("Invoice residuals (%s)", partner.display_name), "account.move.line",
+                 [("move_id", "in", moves.ids), ("account_id.account_type", "in", RECEIVABLE_PAYABLE)], None),
+                (_("Outstanding credits (%s)", partner.display_name), "account.move.line",
+                 wizard._get_credit_domain(), "date asc, id asc"),
+            ]
+        return queries
+
+    @api.model
+    def _explain(self, model, domain, order):
+        query = self.env[model]._search(domain, order=order)
+        self.env.cr.execute(SQL("EXPLAIN (ANALYZE, FORMAT JSON) %s", query.select()))
+        result = self.env.cr.fetchone()[0]
+        if isinstance(result, str):
+            result = json.loads(result)
+        return result[0]
+
+    @api.model
+    def _prepare_diagnosis_vals(self, label, model, domain, order):
+        explain = self._explain(model, domain, order)
+        nodes, stack = [], [explain["Plan"]]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack += node.get("Plans", [])
+        table = self.env[model]._table
+        missing = [name for name, (tablename, _columns, _where) in BATCH_PAYMENT_INDEXES.items()
+                   if tablename == table and not index_exists(self.env.cr, name)]
+        return {
+            "name": label,
+            "model": model,
+            "domain": str(domain),
+            "duration_ms": explain.get("Execution Time", 0.0),
+            "planning_ms": explain.get("Planning Time", 0.0),
+            "rows": explain["Plan"].get("Actual Rows", 0),
+            "index_names": ", ".join(sorted({n["Index Name"] for n in nodes if n.get("Index Name")})),
+            "seq_scans": ", ".join(sorted({n["Relation Name"] for n in nodes if n.get("Node Type") == "Seq Scan"})),
+            "missing_indexes": ", ".join(missing),
+            "plan": json.dumps(explain, indent=2),
+        }
+
+    @api.model
+    def _action_diagnose(self):
+        """Run EXPLAIN ANALYZE on the wizard's domains and open the results."""
+        records = self.create([self._prepare_diagnosis_vals(*query) for query in self._get_diagnosed_queries()])
+        return {
+            "type": "ir.actions.act_window",
+            "name": _("Batch Payment Query Plans"),
+            "res_model": self._name,
+            "view_mode": "list,form",
+            "views": [(self.env.ref("ld_batch_payment_allocation.view_batch_payment_query_diagnosis_list").id, "list"),
+                      (False, "form")],
+            "domain": [("id", "in", records.ids)],
+        }
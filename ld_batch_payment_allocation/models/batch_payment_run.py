@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from ast import literal_eval
+from collections import defaultdict
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from ..wizards.batch_payment_wizard import ALLOCATION_MODES, INVOICE_MOVE_TYPES, PARTNER_TYPES
+
+_logger = logging.getLogger(__name__)
+
+
+class BatchPaymentRun(models.Model):
+    _name = "batch.payment.run"
+    _inherit = ["batch.payment.processing.mixin"]
+    _description = "Batch Payment Run (Many partners -> Many payments)"
+    _order = "id desc"
+
+    _cron_xmlid = "ld_batch_payment_allocation.ir_cron_batch_payment_run"
+
+    name = fields.Char(required=True, copy=False, default=lambda self: _("Payment Run %s", fields.Date.context_today(self)))
+    state = fields.Selection([("draft", "Draft"), ("running", "Running"), ("done", "Done"), ("failed", "Failed")],
+                             default="draft", required=True, readonly=True, copy=False)
+    company_id = fields.Many2one("res.company", default=lambda self: self.env.company, required=True, readonly=True)
+    partner_type = fields.Selection(PARTNER_TYPES, required=True, default="supplier")
+    partner_ids = fields.Many2many("res.partner", string="Partners", domain="[('parent_id','=',False)]",
+                                   help="Leave empty to select the partners with the Partner Filter.")
+    partner_domain = fields.Char(string="Partner Filter", default="[]")
+    due_date_cutoff = fields.Date(string="Due Until", help="Only pay invoices due on or before this date.")
+    invoice_journal_id = fields.Many2one("account.journal", string="Invoice Journal", domain="[('type','in',('sale','purchase'))]")
+    invoice_currency_id = fields.Many2one("res.currency", string="Invoice Currency")
+
+    journal_id = fields.Many2one("account.journal", string="Payment Journal", required=True, domain="[('type','in',('bank','cash'))]")
+    payment_method_line_id = fields.Many2one("account.payment.method.line", string="Payment Method", domain="[('journal_id','=',journal_id)]")
+    payment_date = fields.Date(default=fields.Date.context_today, required=True)
+    communication = fields.Char(string="Memo / Reference")
+    allocation_mode = fields.Selection(ALLOCATION_MODES, default="grouped", required=True, string="Allocation Mode")
+    chunk_size = fields.Integer(string="Partners per Chunk", default=50, required=True,
+                                help="Partners processed, then committed, in each chunk.")
+
+    line_ids = fields.One2many("batch.payment.run.partner", "run_id", string="Partners", readonly=True)
+    partner_count = fields.Integer(compute="_compute_stats")
+    done_count = fields.Integer(string="Processed Partners", compute="_compute_stats")
+    payment_count = fields.Integer(string="Payments", compute="_compute_stats")
+    duration = fields.Float(string="Duration (s)", compute="_compute_stats", digits=(16, 3))
+
+    @api.depends("line_ids.state", "line_ids.payment_ids", "line_ids.duration")
+    def _compute_stats(self):
+        for run in self:
+            run.partner_count = len(run.line_ids)
+            run.done_count = len(run.line_ids.filtered(lambda l: l.state == "done"))
+            run.payment_count = len(run.line_ids.payment_ids)
+            run.duration = sum(run.line_ids.mapped("duration")) + sum(run.line_ids.mapped("load_duration"))
+
+    # ---------- selection ----------
+    def _get_invoice_domain(self, partners=None):
+        self.ensure_one()
+        domain = [
+            ("move_type", "in", INVOICE_MOVE_TYPES[self.partner_type]),
+            ("state", "=", "posted"),
+            ("payment_state", "in", ("not_paid", "partial")),
+            ("company_id", "=", self.company_id.id),
+        ]
+        if partners is not None:
+            domain.append(("commercial_partner_id", "in", partners.ids))
+        elif self.partner_ids:
+            domain.append(("commercial_partner_id", "in", self.partner_ids.commercial_partner_id.ids))
+        elif self.partner_domain and self.partner_domain != "[]":
+            domain.append(("commercial_partner_id", "any", literal_eval(self.partner_domain)))
+        if self.due_date_cutoff:
+            domain.append(("invoice_date_due", "<=", self.due_date_cutoff))
+        if self.invoice_journal_id:
+            domain.append(("journal_id", "=", self.invoice_journal_id.id))
+        if self.invoice_currency_id:
+            domain.append(("currency_id", "=", self.invoice_currency_id.id))
+        return domain
+
+    # ---------- actions ----------
+    def action_prepare(self):
+        """Select the partners with open invoices, one grouped query for the whole run."""
+        for run in self:
+            if run.state != "draft":
+                raise UserError(_("Only draft payment runs can be prepared."))
+            groups = self.env["account.move"]._read_group(
+                run._get_invoice_domain(), groupby=["commercial_partner_id"], aggregates=["__count"],
+            )
+            run.line_ids.unlink()
+            self.env["batch.payment.run.partner"].create([
+                {"run_id": run.id, "partner_id": partner.id, "invoice_count": count}
+                for partner, count in groups
+            ])
+        return True
+
+    def action_run(self):
+        """Queue the pending (or previously failed) partners for the run cron.
+
+        The partners are paid in the background, never inside the request, so
+        a long run cannot hit the worker time limit. A run already running
+        cannot be started a second time.
+        """
+        for run in self:
+            if run.state == "running":
+                raise UserError(_("The payment run %s is already running.", run.name))
+            if run.state == "done":
+                raise UserError(_("The payment run %s is already done.", run.name))
+            # Settings errors are reported now rather than failing every chunk in the cron
+            Wizard = self.env["batch.payment.allocation.wizard"]
+            Wizard.new(Wizard._prepare_settings_vals(run, self.env["res.partner"]))._check_allocation_settings()
+            if not run.line_ids:
+                run.action_prepare()
+            run.line_ids.filtered(lambda l: l.state == "failed").write({"state": "pending", "error": False})
+            run.write({"state": "running", "error": False})
+        self._trigger_cron()
+        return True
+
+    def action_reset(self):
+        self.filtered(lambda r: r.state in ("failed", "done")).state = "draft"
+        return True
+
+    def _get_processed_payments(self):
+        return self.line_ids.payment_ids
+
+    # ---------- processing ----------
+    @api.model
+    def _cron_process_runs(self):
+        """Pay the partners of running runs, see ``_cron_process``.
+
+        A chunk interrupted by a crash or a timeout is rolled back as a whole;
+        its partners are still pending and the next execution resumes them.
+        """
+        self._cron_process()
+
+    def _fail_processing(self, run_partners, error):
+        super()._fail_processing(run_partners, error)
+        run_partners.write({"state": "failed", "error": str(error)})
+
+    def _process_chunk(self, run_partners):
+        """Pay the open invoices of ``run_partners`` with one load for the whole chunk."""
+        self.ensure_one()
+        start = time.perf_counter()
+        partners = run_partners.partner_id
+        moves = self.env["account.move"].search_fetch(
+            self._get_invoice_domain(partners), ["name", "currency_id", "commercial_partner_id"],
+            order="invoice_date asc, name asc, id asc",
+        )
+        Wizard = self.env["batch.payment.allocation.wizard"]
+        wizards = Wizard.create([Wizard._prepare_settings_vals(self, run_partner.partner_id) for run_partner in run_partners])
+        wizards[:1]._check_allocation_settings()
+        residuals = wizards[:1]._get_residuals_by_move(moves)
+        moves_by_partner = defaultdict(list)
+        for mv in moves:
+            moves_by_partner[mv.commercial_partner_id.id].append(mv)
+        load_duration = (time.perf_counter() - start) / max(len(run_partners), 1)
+
+        date = self.payment_date or fields.Date.context_today(self)
+        for run_partner, wizard in zip(run_partners, wizards):
+            start = time.perf_counter()
+            items = [(mv, None) for mv in moves_by_partner[run_partner.partner_id.id]]
+            vals = {"load_duration": load_duration, "invoice_count": len(items), "error": False}
+            try:
+                with self.env.cr.savepoint():
+                    allocations = wizard._clamp_to_residual_paycur(items, date=date, residuals=residuals)
+                    payments = wizard._allocate(allocations, date) if allocations else self.env["account.payment"]
+                vals.update({
+                    "state": "done",
+                    "payment_ids": [(6, 0, payments.ids)],
+                    "amount": sum(payments.mapped("amount")),
+                })
+            except Exception as e:
+                _logger.exception("Payment run %s failed for partner %s", self.id, run_partner.partner_id.id)
+                vals.update({"state": "failed", "error": str(e)})
+            vals["duration"] = time.perf_counter() - start
+            run_partner.write(vals)
+
+
+class BatchPaymentRunPartner(models.Model):
+    _name = "batch.payment.run.partner"
+    _description = "Batch Payment Run Partner"
+    _order = "run_id, id"
+
+    run_id = fields.Many2one("batch.payment.run", required=True, ondelete="cascade", index=True)
+    partner_id = fields.Many2one("res.partner", string="Partner", required=True, readonly=True)
+    state = fields.Selection([("pending", "Pending"), ("done", "Done"), ("failed", "Failed")],
+                             default="pending", required=True, readonly=True)
+    invoice_count = fields.Integer(string="Invoices", readonly=True)
+    payment_ids = fields.Many2many("account.payment", string="Payments", readonly=True)
+    payment_count = fields.Integer(string="Payment Count", compute="_compute_payment_count")
+    amount = fields.Float(string="Amount Paid (Payment Currency)", readonly=True)
+    load_duration = fields.Float(string="Load (s)", readonly=True, digits=(16, 3),
+                                 help="Share of the chunk's grouped invoice/residual load.")
+    duration = fields.Float(string="Allocation (s)", readonly=True, digits=(16, 3))
+    error = fields.Text(readonly=True)
+
+    @api.depends("payment_ids")
+    def _compute_payment_count(self):
+        for rec in self:
+            rec.payment_count = len(rec.payment_ids)
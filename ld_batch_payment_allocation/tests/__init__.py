@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+from . import test_allocation
+from . import test_credit_application
+from . import test_benchmark
+from . import test_payment_run
+from . import test_allocation_job
+from . import test_auto_allocation
+from . import test_remittance_import
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from contextlib import contextmanager
+
+from odoo import fields
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+_logger = logging.getLogger(__name__)
+
+INVOICE_DATE = "2026-01-15"
+PAYMENT_DATE = "2026-02-15"
+
+# Sizes used by the tagged benchmark; the standard suite stays small
+BENCHMARK_SIZES = (10, 1000, 10000)
+
+
+class BatchPaymentAllocationCommon(AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company_currency = cls.company_data["currency"]
+        # 1 company currency = 2 foreign currency units at the invoice and payment dates
+        cls.foreign_currency = cls.setup_other_currency("EUR")
+        cls.bank_journal = cls.company_data["default_journal_bank"]
+        cls.receivable_account = cls.company_data["default_account_receivable"]
+        cls.counterpart_account = cls.company_data["default_account_revenue"]
+
+    # ---------- data generators ----------
+    @classmethod
+    def _create_partner(cls, name="Batch Payment Partner"):
+        return cls.env["res.partner"].create({"name": name})
+
+    @classmethod
+    def _create_invoices(cls, partner, count, amount=100.0, move_type="out_invoice", currency=None, date=INVOICE_DATE):
+        """Create and post ``count`` invoices of ``amount`` (untaxed) for ``partner`` in one batch."""
+        currency = currency or cls.company_currency
+        moves = cls.env["account.move"].create([{
+            "move_type": move_type,
+            "partner_id": partner.id,
+            "invoice_date": date,
+            "date": date,
+            "currency_id": currency.id,
+            "invoice_line_ids": [(0, 0, {
+                "name": "Batch payment test line %s" % index,
+                "quantity": 1.0,
+                "price_unit": amount,
+                "tax_ids": [(6, 0, [])],
+            })],
+        } for index in range(count)])
+        moves.action_post()
+        return moves
+
+    @classmethod
+    def _create_refunds(cls, partner, count, amount=40.0, partner_type="customer", currency=None, date=INVOICE_DATE):
+        """Create and post ``count`` credit notes of ``amount`` for ``partner`` in one batch."""
+        move_type = "out_refund" if partner_type == "customer" else "in_refund"
+        return cls._create_invoices(partner, count, amount=amount, move_type=move_type, currency=currency, date=date)
+
+    @classmethod
+    def _create_credits(cls, partner, count, amount=50.0, currency=None, date=INVOICE_DATE, refs=None):
+        """Create and post ``count`` outstanding receivable credits of ``amount`` for ``partner``.
+
+        Credits are plain journal entries crediting the receivable account, so
+        they are outstanding items without being invoices or payments.
+        """
+        currency = currency or cls.company_currency
+        balance = currency._convert(amount, cls.company_currency, cls.env.company, fields.Date.to_date(date))
+        refs = refs or [False] * count
+        moves = cls.env["account.move"].create([{
+            "move_type": "entry",
+            "date": date,
+            "ref": ref,
+            "journal_id": cls.company_data["default_journal_misc"].id,
+            "line_ids": [
+                (0, 0, {
+                    "name": "Outstanding credit %s" % index,
+                    "account_id": cls.receivable_account.id,
+                    "partner_id": partner.id,
+                    "currency_id": currency.id,
+                    "amount_currency": -amount,
+                    "balance": -balance,
+                }),
+                (0, 0, {
+                    "name": "Outstanding credit counterpart %s" % index,
+                    "account_id": cls.counterpart_account.id,
+                    "currency_id": currency.id,
+                    "amount_currency": amount,
+                    "balance": balance,
+                }),
+            ],
+        } for index, ref in zip(range(count), refs)])
+        moves.action_post()
+        return moves.line_ids.filtered(lambda l: l.account_id == cls.receivable_account)
+
+    def _create_wizard(self, partner, partner_type="customer", **vals):
+        """Allocation wizard for ``partner`` with every matching invoice loaded."""
+        wizard = self.env["batch.payment.allocation.wizard"].create(dict({
+            "partner_type": partner_type,
+            "partner_id": partner.id,
+            "journal_id": self.bank_journal.id,
+            "payment_date": PAYMENT_DATE,
+            "payment_currency_id": (self.bank_journal.currency_id or self.company_currency).id,
+            "page_size": 0,
+            "credit_page_size": 0,
+        }, **vals))
+        return wizard
+
+    # ---------- measurement ----------
+    @contextmanager
+    def _measure(self, label, size):
+        """Record wall time and SQL queries of the block, flushed, on a cold cache.
+
+        Yields a dict filled with ``seconds`` and ``queries`` when the block exits.
+        """
+        self.env.flush_all()
+        self.env.invalidate_all()
+        result = {"label": label, "size": size}
+        queries_before = self.env.cr.sql_log_count
+        start = time.perf_counter()
+        yield result
+        self.env.flush_all()
+        result["seconds"] = time.perf_counter() - start
+        result["queries"] = self.env.cr.sql_log_count - queries_before
+        _logger.info("Batch payment %(label)s, N=%(size)s: %(seconds).3f s, %(queries)s queries", result)
+
+    def assertQueriesBounded(self, small, large, per_record=0):
+        """Check that going from ``small`` to ``large`` records adds at most
+        ``per_record`` queries per extra record (0: the query count must stay flat).
+
+        A small fixed margin absorbs cache warm-up differences between runs.
+        """
+        extra = large["size"] - small["size"]
+        self.assertLessEqual(
+            large["queries"], small["queries"] + per_record * extra + 5,
+            "%s issued %s queries for %s records against %s for %s records"
+            % (large["label"], large["queries"], large["size"], small["queries"], small["size"]),
+        )
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+from odoo.tests import Form, tagged
+from odoo.tools import SQL
+
+from .common import BatchPaymentAllocationCommon, PAYMENT_DATE
+
+
+@tagged("post_install", "-at_install")
+class TestBatchPaymentAllocation(BatchPaymentAllocationCommon):
+
+    def test_load_invoices_single_currency(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 10, amount=100.0)
+        wizard = self._create_wizard(partner)
+        wizard._load_invoices()
+
+        self.assertEqual(wizard.matching_count, 10)
+        self.assertEqual(wizard.line_ids.move_id, moves)
+        self.assertAlmostEqual(wizard.total_to_pay, 1000.0)
+        self.assertEqual(set(wizard.line_ids.mapped("residual_in_payment_currency")), {100.0})
+
+    def test_load_invoices_multi_currency(self):
+        partner = self._create_partner()
+        self._create_invoices(partner, 10, amount=100.0, currency=self.foreign_currency)
+        wizard = self._create_wizard(partner)
+        wizard._load_invoices()
+
+        self.assertEqual(set(wizard.line_ids.mapped("residual_in_invoice_currency")), {100.0})
+        # Paid in company currency at a rate of 2 foreign units per company unit
+        self.assertEqual(set(wizard.line_ids.mapped("residual_in_payment_currency")), {50.0})
+        self.assertAlmostEqual(wizard.total_to_pay, 500.0)
+
+    def test_load_vendor_bills(self):
+        partner = self._create_partner()
+        self._create_invoices(partner, 5, amount=80.0, move_type="in_invoice")
+        wizard = self._create_wizard(partner, partner_type="supplier")
+        wizard._load_invoices()
+
+        # Payable residuals are negative; the wizard works with the amount owed
+        self.assertEqual(set(wizard.line_ids.mapped("residual_in_company_currency")), {80.0})
+        self.assertAlmostEqual(wizard.total_to_pay, 400.0)
+
+    def test_journal_currency_change_converts_typed_amounts(self):
+        partner = self._create_partner()
+        self._create_invoices(partner, 2, amount=100.0)
+        foreign_journal = self.env["account.journal"].create({
+            "name": "Foreign Bank", "type": "bank", "code": "FBNK", "currency_id": self.foreign_currency.id,
+        })
+        wizard_form = Form(self.env["batch.payment.allocation.wizard"])
+        wizard_form.partner_type = "customer"
+        wizard_form.journal_id = self.bank_journal
+        wizard_form.payment_date = PAYMENT_DATE
+        wizard_form.partner_id = partner
+        with wizard_form.line_ids.edit(0) as line:
+            line.amount_to_pay = 40.0
+
+        # 1 company currency = 2 foreign units: the typed 40 becomes 80, the full residual follows
+        wizard_form.journal_id = foreign_journal
+        self.assertEqual(wizard_form.payment_currency_id, self.foreign_currency)
+        for index, expected in enumerate((80.0, 200.0)):
+            with wizard_form.line_ids.edit(index) as line:
+                self.assertEqual(line.amount_to_pay, expected)
+        wizard = wizard_form.save()
+
+        self.assertEqual(wizard.line_ids.mapped("amount_to_pay"), [80.0, 200.0])
+        self.assertEqual(wizard.line_ids.mapped("residual_in_payment_currency"), [200.0, 200.0])
+        self.assertAlmostEqual(wizard.total_to_pay, 280.0)
+
+    def test_allocate_custom_rate_books_payments(self):
+        foreign_journal = self.env["account.journal"].create({
+            "name": "Foreign Bank", "type": "bank", "code": "FBNK", "currency_id": self.foreign_currency.id,
+        })
+        for allocation_mode in ("grouped", "per_invoice"):
+            with self.subTest(allocation_mode=allocation_mode):
+                partner = self._create_partner("Custom Rate %s" % allocation_mode)
+                moves = self._create_invoices(partner, 2, amount=100.0)
+                wizard = self._create_wizard(partner, journal_id=foreign_journal.id, allocation_mode=allocation_mode,
+                                             payment_currency_id=self.foreign_currency.id,
+                                             rate_source="custom", custom_rate=4.0)
+                wizard._load_invoices()
+                # 1 company currency = 4 foreign units instead of the company rate of 2
+                self.assertEqual(set(wizard.line_ids.mapped("residual_in_payment_currency")), {400.0})
+                action = wizard.action_allocate()
+
+                payments = self.env["account.payment"].browse(action["domain"][0][2])
+                self.assertAlmostEqual(sum(payments.mapped("amount")), 800.0)
+                self.assertAlmostEqual(sum(payments.move_id.line_ids.mapped("debit")), 200.0)
+                self.assertEqual(set(moves.mapped("amount_residual")), {0.0})
+
+    def test_load_pages(self):
+        partner = self._create_partner()
+        self._create_invoices(partner, 10)
+        wizard = self._create_wizard(partner, page_size=4)
+        wizard._load_invoices()
+        self.assertEqual(len(wizard.line_ids), 4)
+        self.assertTrue(wizard.has_more)
+        self.assertAlmostEqual(wizard.matching_total, 1000.0)
+
+        wizard.select_all_matching = True
+        self.assertAlmostEqual(wizard.total_to_pay, 1000.0)
+        self.assertEqual(len(wizard._get_allocation_items()), 10)
+
+    def test_clamp_to_residual(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 3, amount=100.0)
+        wizard = self._create_wizard(partner)
+        allocations = wizard._clamp_to_residual_paycur([(moves[0], 1000.0), (moves[1], None), (moves[2], 30.0)])
+        self.assertEqual([(move, amount) for move, amount, _residual in allocations],
+                         [(moves[0], 100.0), (moves[1], 100.0), (moves[2], 30.0)])
+
+    def test_refunds_are_not_paid(self):
+        """Open refunds are neither loaded, counted nor paid: they are offered
+        as outstanding credits instead, in both allocation modes."""
+        for partner_type, invoice_type, payment_type in (
+            ("customer", "out_invoice", "inbound"),
+            ("supplier", "in_invoice", "outbound"),
+        ):
+            for allocation_mode in ("grouped", "per_invoice"):
+                with self.subTest(partner_type=partner_type, allocation_mode=allocation_mode):
+                    partner = self._create_partner("Refund %s %s" % (partner_type, allocation_mode))
+                    invoices = self._create_invoices(partner, 3, amount=100.0, move_type=invoice_type)
+                    refund = self._create_refunds(partner, 1, amount=40.0, partner_type=partner_type)
+                    wizard = self._create_wizard(partner, partner_type=partner_type, allocation_mode=allocation_mode)
+                    wizard._load_invoices()
+                    wizard._onchange_partner_unreconciled()
+
+                    self.assertEqual(wizard.line_ids.move_id, invoices)
+                    self.assertEqual(wizard.matching_count, 3)
+                    self.assertAlmostEqual(wizard.matching_total, 300.0)
+                    self.assertAlmostEqual(wizard.total_to_pay, 300.0)
+                    self.assertEqual(wizard.unreconciled_payment_line_ids.aml_id.move_id, refund)
+
+                    action = wizard.action_allocate()
+                    payments = self.env["account.payment"].browse(action["domain"][0][2])
+                    self.assertEqual(set(payments.mapped("payment_type")), {payment_type})
+                    self.assertAlmostEqual(sum(payments.mapped("amount")), 300.0)
+                    self.assertEqual(set(invoices.mapped("amount_residual")), {0.0})
+                    self.assertAlmostEqual(refund.amount_residual, 40.0)
+
+    def test_clamp_refund_to_zero(self):
+        partner = self._create_partner()
+        refund = self._create_refunds(partner, 1, amount=40.0)
+        wizard = self._create_wizard(partner)
+        allocations = wizard._clamp_to_residual_paycur([(refund, None), (refund, 50.0)])
+        self.assertEqual([(amount, residual) for _move, amount, residual in allocations], [(0.0, -40.0), (0.0, -40.0)])
+
+    def test_bulk_payments_never_refund(self):
+        partner = self._create_partner()
+        invoice = self._create_invoices(partner, 1, amount=100.0)
+        refund = self._create_refunds(partner, 1, amount=40.0)
+        wizard = self._create_wizard(partner, allocation_mode="per_invoice")
+        wizard._check_allocation_settings()
+        payments = wizard._allocate([(invoice, 100.0, 100.0), (refund, 40.0, 40.0)], wizard.payment_date)
+
+        self.assertEqual(len(payments), 1)
+        self.assertEqual(payments.payment_type, "inbound")
+        self.assertAlmostEqual(refund.amount_residual, 40.0)
+
+    def test_allocate_per_invoice(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 10, amount=100.0)
+        wizard = self._create_wizard(partner, allocation_mode="per_invoice")
+        wizard._load_invoices()
+        wizard.line_ids[0].amount_to_pay = 40.0
+        action = wizard.action_allocate()
+
+        payments = self.env["account.payment"].browse(action["domain"][0][2])
+        self.assertEqual(len(payments), 10)
+        self.assertAlmostEqual(sum(payments.mapped("amount")), 940.0)
+        self.assertAlmostEqual(moves[0].amount_residual, 60.0)
+        self.assertEqual(set(moves[1:].mapped("amount_residual")), {0.0})
+
+    def test_allocate_per_invoice_early_payment_discount(self):
+        partner = self._create_partner()
+        payment_term = self.env["account.payment.term"].create({
+            "name": "2% 10 days, net 30",
+            "early_discount": True,
+            "discount_percentage": 2.0,
+            "discount_days": 10,
+            "line_ids": [(0, 0, {"value": "percent", "value_amount": 100.0, "nb_days": 30})],
+        })
+        invoices = self._create_invoices(partner, 2, amount=100.0)
+        invoices.button_draft()
+        invoices[0].invoice_payment_term_id = payment_term
+        invoices.action_post()
+        wizard = self._create_wizard(partner, allocation_mode="per_invoice", payment_date="2026-01-20")
+        wizard._check_allocation_settings()
+        # Within the discount period, 98 settles the discounted invoice through the register
+        payments = wizard._allocate([(invoices[0], 98.0, 100.0), (invoices[1], 100.0, 100.0)], wizard.payment_date)
+
+        self.assertEqual(len(payments), 2)
+        self.assertAlmostEqual(sum(payments.mapped("amount")), 198.0)
+        self.assertEqual(set(invoices.mapped("amount_residual")), {0.0})
+
+    def test_allocate_grouped(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 10, amount=100.0)
+        wizard = self._create_wizard(partner, allocation_mode="grouped")
+        wizard._load_invoices()
+        action = wizard.action_allocate()
+
+        payments = self.env["account.payment"].browse(action["domain"][0][2])
+        self.assertEqual(len(payments), 1)
+        self.assertAlmostEqual(payments.amount, 1000.0)
+        self.assertEqual(payments.date.isoformat(), PAYMENT_DATE)
+        self.assertEqual(set(moves.mapped("amount_residual")), {0.0})
+
+    def test_allocate_grouped_multi_currency_falls_back(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 4, amount=100.0, currency=self.foreign_currency)
+        wizard = self._create_wizard(partner, allocation_mode="grouped")
+        wizard._load_invoices()
+        action = wizard.action_allocate()
+
+        payments = self.env["account.payment"].browse(action["domain"][0][2])
+        self.assertEqual(wizard.allocation_mode, "per_invoice")
+        self.assertEqual(len(payments), 4)
+        self.assertAlmostEqual(sum(payments.mapped("amount")), 200.0)
+        self.assertEqual(set(moves.mapped("amount_residual")), {0.0})
+
+    def test_allocate_locked_is_idempotent(self):
+        for allocation_mode in ("grouped", "per_invoice"):
+            with self.subTest(allocation_mode=allocation_mode):
+                partner = self._create_partner("Locked Allocation %s" % allocation_mode)
+                moves = self._create_invoices(partner, 3, amount=100.0)
+                wizard = self._create_wizard(partner, allocation_mode=allocation_mode, lock_mode="skip_locked")
+                wizard._load_invoices()
+                action = wizard.action_allocate()
+
+                payments = self.env["account.payment"].browse(action["domain"][0][2])
+                self.assertTrue(payments)
+                self.assertEqual(set(payments.mapped("batch_allocation_key")), {wizard.allocation_key})
+                self.assertEqual(set(moves.mapped("amount_residual")), {0.0})
+                # Submitting the same wizard again opens the payments instead of paying twice
+                self.assertEqual(wizard.action_allocate()["domain"][0][2], payments.ids)
+
+    def _patch_locked_lines(self, wizard, get_locked_sql):
+        """Replace the locking statement of ``wizard`` by ``get_locked_sql(move_ids, lock)``."""
+        Wizard = type(wizard)
+        get_open_lines_sql = Wizard._get_open_lines_sql
+
+        def _get_open_lines_sql(wiz, move_ids, lock=None):
+            return get_locked_sql(move_ids, lock) if lock else get_open_lines_sql(wiz, move_ids)
+        return patch.object(Wizard, "_get_open_lines_sql", _get_open_lines_sql)
+
+    def test_allocate_skips_held_invoices(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 2, amount=100.0)
+        wizard = self._create_wizard(partner, lock_mode="skip_locked")
+        wizard._load_invoices()
+
+        # Another transaction holds the first invoice: SKIP LOCKED leaves its lines out
+        get_open_lines_sql = type(wizard)._get_open_lines_sql
+
+        def get_locked_sql(move_ids, lock):
+            return get_open_lines_sql(wizard, [move_id for move_id in move_ids if move_id != moves[0].id], lock)
+        with self._patch_locked_lines(wizard, get_locked_sql):
+            action = wizard.action_allocate()
+
+        self.assertEqual(action["tag"], "display_notification")
+        self.assertIn(moves[0].name, action["params"]["message"])
+        payments = self.env["account.payment"].browse(action["params"]["next"]["domain"][0][2])
+        self.assertAlmostEqual(sum(payments.mapped("amount")), 100.0)
+        self.assertEqual(moves.mapped("amount_residual"), [100.0, 0.0])
+
+    def test_allocate_nowait_raises_when_held(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 2, amount=100.0)
+        wizard = self._create_wizard(partner, lock_mode="nowait")
+        wizard._load_invoices()
+
+        # The error PostgreSQL raises when FOR UPDATE NOWAIT meets a held row
+        def get_locked_sql(move_ids, lock):
+            return SQL("DO $$ BEGIN RAISE EXCEPTION 'row held' USING ERRCODE = 'lock_not_available'; END $$")
+        with self._patch_locked_lines(wizard, get_locked_sql), self.assertRaises(UserError):
+            wizard.action_allocate()
+
+        self.assertFalse(wizard._get_allocated_payments())
+        self.assertEqual(set(moves.mapped("amount_residual")), {100.0})
+
+    def test_query_count_bounded(self):
+        """Loading must not issue more queries with more invoices; allocating
+        may only add the per-payment cost of creating and posting records."""
+        results = {}
+        for size in (5, 25):
+            partner = self._create_partner("Query Count Partner %s" % size)
+            self._create_invoices(partner, size)
+            wizard = self._create_wizard(partner, allocation_mode="per_invoice")
+            with self._measure("load", size) as load:
+                wizard._load_invoices()
+            with self._measure("allocate per invoice", size) as allocate:
+                wizard.action_allocate()
+            results[size] = (load, allocate)
+
+        self.assertQueriesBounded(results[5][0], results[25][0])
+        self.assertQueriesBounded(results[5][1], results[25][1], per_record=30)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+from odoo.exceptions import AccessError, UserError
+from odoo.tests import new_test_user, tagged
+
+from .common import BatchPaymentAllocationCommon
+
+
+@tagged("post_install", "-at_install")
+class TestBatchPaymentAllocationJob(BatchPaymentAllocationCommon):
+
+    def _create_allocate_job(self, partner, chunk_size=1, **vals):
+        wizard = self._create_wizard(partner, **vals)
+        wizard._load_invoices()
+        job = self.env["batch.payment.allocation.job"].browse(wizard.action_allocate_async()["res_id"])
+        job.chunk_size = chunk_size
+        return job
+
+    def _create_credit_job(self, partner):
+        wizard = self._create_wizard(partner, apply_all_credits=True)
+        wizard._load_invoices()
+        return self.env["batch.payment.allocation.job"].browse(wizard.action_apply_selected_payments_async()["res_id"])
+
+    def test_cron_allocates_job(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 3, amount=100.0)
+        job = self._create_allocate_job(partner, allocation_mode="per_invoice")
+        self.assertEqual(job.state, "pending")
+
+        self.env["batch.payment.allocation.job"]._cron_process_jobs()
+        self.assertEqual(job.state, "done")
+        self.assertEqual(job.processed_count, 3)
+        self.assertEqual(set(job.line_ids.mapped("state")), {"done"})
+        self.assertEqual(job.payment_count, 3)
+        self.assertEqual(set(moves.mapped("amount_residual")), {0.0})
+
+    def test_retry_does_not_pay_twice(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 2, amount=100.0)
+        job = self._create_allocate_job(partner, allocation_mode="per_invoice")
+
+        Wizard = type(self.env["batch.payment.allocation.wizard"])
+        allocate = Wizard._allocate
+        calls = []
+
+        def _allocate(wizard, allocations, date):
+            calls.append(allocations)
+            if len(calls) == 2:
+                raise UserError("Second chunk failure")
+            return allocate(wizard, allocations, date)
+
+        with patch.object(Wizard, "_allocate", _allocate):
+            self.env["batch.payment.allocation.job"]._cron_process_jobs()
+        self.assertEqual(job.state, "failed")
+        self.assertEqual(job.line_ids.mapped("state"), ["done", "pending"])
+        self.assertEqual(moves.mapped("amount_residual"), [0.0, 100.0])
+
+        job.action_retry()
+        self.env["batch.payment.allocation.job"]._cron_process_jobs()
+        self.assertEqual(job.state, "done")
+        self.assertEqual(job.processed_count, 2)
+        self.assertEqual(job.payment_count, 2)
+        self.assertAlmostEqual(sum(job.payment_ids.mapped("amount")), 200.0)
+        self.assertEqual(set(moves.mapped("amount_residual")), {0.0})
+
+    def test_failed_credits_fail_the_job(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 2, amount=100.0)
+        credits = self._create_credits(partner, 2, amount=50.0)
+        job = self._create_credit_job(partner)
+
+        AccountMoveLine = type(self.env["account.move.line"])
+        with patch.object(AccountMoveLine, "_reconcile_plan", side_effect=UserError("Reconciliation failure")):
+            self.env["batch.payment.allocation.job"]._cron_process_jobs()
+        self.assertEqual(job.state, "failed")
+        self.assertTrue(job.error)
+        self.assertEqual(set(job.line_ids.mapped("state")), {"failed"})
+        self.assertFalse(any(credits.mapped("reconciled")))
+
+        job.action_retry()
+        self.env["batch.payment.allocation.job"]._cron_process_jobs()
+        self.assertEqual(job.state, "done")
+        self.assertFalse(job.error)
+        self.assertEqual(set(job.line_ids.mapped("state")), {"done"})
+        self.assertEqual(moves.mapped("amount_residual"), [0.0, 100.0])
+
+    def test_job_runs_as_its_creator(self):
+        billing_user = new_test_user(self.env, "batch_job_billing", groups="base.group_user,account.group_account_invoice")
+        other_billing_user = new_test_user(self.env, "batch_job_billing_2",
+                                           groups="base.group_user,account.group_account_invoice")
+        internal_user = new_test_user(self.env, "batch_job_internal", groups="base.group_user")
+        admin = self.env.ref("base.user_admin")
+        Job = self.env["batch.payment.allocation.job"]
+        vals = {
+            "partner_type": "customer",
+            "partner_id": self._create_partner().id,
+            "journal_id": self.bank_journal.id,
+            "user_id": admin.id,
+        }
+
+        with self.assertRaises(AccessError):
+            Job.with_user(internal_user).create(vals)
+        job = Job.with_user(billing_user).create(vals)
+        # The requested user is ignored: the job pays with its creator's rights
+        self.assertEqual(job.user_id, billing_user)
+        with self.assertRaises(AccessError):
+            job.write({"user_id": admin.id})
+        self.assertFalse(Job.with_user(other_billing_user).search([("id", "=", job.id)]))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import time
+
+from odoo.tests import tagged
+from odoo.tests.common import BaseCase
+
+from ..wizards import allocation_strategies
+from .common import BatchPaymentAllocationCommon
+
+
+@tagged("post_install", "-at_install")
+class TestBatchPaymentAutoAllocation(BatchPaymentAllocationCommon):
+
+    def _auto_allocate(self, partner, target, strategy, **vals):
+        wizard = self._create_wizard(partner, target_amount=target, allocation_strategy=strategy, **vals)
+        wizard._load_invoices()
+        wizard.action_auto_allocate()
+        return {line.move_id: line.amount_to_pay for line in wizard.line_ids}
+
+    def test_auto_allocate_ignores_refunds(self):
+        for strategy in ("fifo", "proportional", "exact_subset"):
+            with self.subTest(strategy=strategy):
+                partner = self._create_partner("Auto Allocation %s" % strategy)
+                invoices = self._create_invoices(partner, 2, amount=100.0)
+                self._create_refunds(partner, 1, amount=50.0)
+                amounts = self._auto_allocate(partner, 200.0, strategy)
+
+                self.assertEqual(set(amounts), set(invoices))
+                self.assertEqual(list(amounts.values()), [100.0, 100.0])
+
+    def test_auto_allocate_fills_unloaded_pages(self):
+        partner = self._create_partner()
+        invoices = self._create_invoices(partner, 3, amount=100.0)
+        amounts = self._auto_allocate(partner, 150.0, "fifo", page_size=1)
+
+        # The loaded line is updated and the second invoice's line is created in the same write
+        self.assertEqual(amounts, {invoices[0]: 100.0, invoices[1]: 50.0})
+
+
+@tagged("post_install", "-at_install")
+class TestAllocationStrategies(BaseCase):
+    """The strategies are pure functions on integer minor units."""
+
+    ROWS = [("a", 50000), ("b", 30000), ("c", 12000), ("d", 7000), ("e", 1000)]
+
+    def test_fill_in_order(self):
+        self.assertEqual(allocation_strategies.fill_in_order(self.ROWS, 85000), {"a": 50000, "b": 30000, "c": 5000})
+        self.assertEqual(allocation_strategies.fill_in_order(self.ROWS, 0), {})
+
+    def test_proportional_adds_up(self):
+        result = allocation_strategies.proportional([("a", 300), ("b", 100), ("c", 100)], 101)
+        # Largest remainder: the leftover unit goes to the largest residual
+        self.assertEqual(result, {"a": 61, "b": 20, "c": 20})
+        self.assertEqual(allocation_strategies.proportional(self.ROWS, 10 ** 6), dict(self.ROWS))
+
+    def test_exact_subset(self):
+        self.assertEqual(allocation_strategies.exact_subset(self.ROWS, 63000, 1.0), {"a": 50000, "c": 12000, "e": 1000})
+        self.assertEqual(allocation_strategies.exact_subset(self.ROWS, 37000, 1.0), {"b": 30000, "d": 7000})
+        self.assertIsNone(allocation_strategies.exact_subset(self.ROWS, 500, 1.0))
+
+    def test_exact_subset_time_bound(self):
+        # Even residuals never add up to an odd target: the search space is exhausted or the limit hit
+        rows = [(index, 2 * (index + 1)) for index in range(60)]
+        start = time.monotonic()
+        self.assertIsNone(allocation_strategies.exact_subset(rows, 1001, 0.05))
+        self.assertLess(time.monotonic() - start, 1.0)
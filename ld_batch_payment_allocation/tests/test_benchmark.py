@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo.tests import tagged
+
+from .common import BatchPaymentAllocationCommon, BENCHMARK_SIZES
+
+_logger = logging.getLogger(__name__)
+
+
+@tagged("post_install", "-at_install", "-standard", "batch_payment_perf")
+class TestBatchPaymentBenchmark(BatchPaymentAllocationCommon):
+    """Wall time and query counts at 10, 1,000 and 10,000 invoices.
+
+    Not part of the standard run; start it with
+    ``--test-tags /ld_batch_payment_allocation:TestBatchPaymentBenchmark``.
+    Each scenario also checks its monetary result so a fast wrong answer
+    does not pass as an improvement. Loading is also measured through the
+    original per-move loader, logged as "load baseline", for comparison.
+    """
+
+    def _currencies(self):
+        return (("single", self.company_currency), ("multi", self.foreign_currency))
+
+    def _log_results(self, results):
+        for result in results:
+            _logger.info("%(label)-40s N=%(size)6s %(seconds)10.3f s %(queries)8s queries", result)
+
+    def _load_invoices_baseline(self, wizard):
+        """Reference path: the loader as it was before the grouped residual query.
+
+        Reads the receivable/payable lines of each move with ``filtered()`` and
+        ``mapped()`` and converts each residual with its own rate lookup, so the
+        benchmark reports the gain against the original implementation.
+        """
+        moves = self.env["account.move"].search(wizard._get_invoice_domain(), order="invoice_date asc, name asc")
+        lines = []
+        for mv in moves:
+            rec_lines = mv.line_ids.filtered(
+                lambda l: l.account_id and l.account_id.account_type in ("asset_receivable", "liability_payable"))
+            residual_company = sum(rec_lines.mapped("amount_residual"))
+            residual_invoice = sum(rec_lines.mapped("amount_residual_currency")) if mv.currency_id else residual_company
+            if residual_company == 0 and residual_invoice == 0:
+                continue
+            residual_pay_cur = wizard._convert_amount(residual_company, wizard.payment_date)
+            lines.append((0, 0, {
+                "move_id": mv.id,
+                "name": mv.name,
+                "invoice_date": mv.invoice_date,
+                "residual_in_company_currency": residual_company,
+                "residual_in_invoice_currency": residual_invoice,
+                "residual_in_payment_currency": residual_pay_cur,
+                "amount_to_pay": residual_pay_cur,
+            }))
+        wizard.line_ids = [(5, 0, 0)] + lines
+
+    def test_benchmark_load(self):
+        results = []
+        for size in BENCHMARK_SIZES:
+            for label, currency in self._currencies():
+                with self.subTest(size=size, currency=label):
+                    partner = self._create_partner("Load Benchmark %s %s" % (label, size))
+                    self._create_invoices(partner, size, amount=100.0, currency=currency)
+                    expected = 100.0 * size if currency == self.company_currency else 50.0 * size
+                    baseline = self._create_wizard(partner)
+                    with self._measure("load baseline (%s currency)" % label, size) as result:
+                        self._load_invoices_baseline(baseline)
+                    results.append(result)
+                    wizard = self._create_wizard(partner)
+                    with self._measure("load (%s currency)" % label, size) as result:
+                        wizard._load_invoices()
+                    results.append(result)
+                    for loaded in (baseline, wizard):
+                        self.assertEqual(len(loaded.line_ids), size)
+                        self.assertAlmostEqual(loaded.total_to_pay, expected, places=2)
+        self._log_results(results)
+
+    def test_benchmark_allocate_per_invoice(self):
+        results = []
+        for size in BENCHMARK_SIZES:
+            for label, currency in self._currencies():
+                with self.subTest(size=size, currency=label):
+                    partner = self._create_partner("Per Invoice Benchmark %s %s" % (label, size))
+                    moves = self._create_invoices(partner, size, amount=100.0, currency=currency)
+                    wizard = self._create_wizard(partner, allocation_mode="per_invoice")
+                    wizard._load_invoices()
+                    with self._measure("allocate per invoice (%s currency)" % label, size) as result:
+                        action = wizard.action_allocate()
+                    results.append(result)
+                    self.assertEqual(len(action["domain"][0][2]), size)
+                    self.assertFalse(any(moves.mapped("amount_residual")))
+        self._log_results(results)
+
+    def test_benchmark_allocate_grouped(self):
+        results = []
+        for size in BENCHMARK_SIZES:
+            with self.subTest(size=size):
+                partner = self._create_partner("Grouped Benchmark %s" % size)
+                moves = self._create_invoices(partner, size, amount=100.0)
+                wizard = self._create_wizard(partner, allocation_mode="grouped")
+                wizard._load_invoices()
+                with self._measure("allocate grouped", size) as result:
+                    action = wizard.action_allocate()
+                results.append(result)
+                payments = self.env["account.payment"].browse(action["domain"][0][2])
+                self.assertEqual(len(payments), 1)
+                self.assertAlmostEqual(payments.amount, 100.0 * size, places=2)
+                self.assertFalse(any(moves.mapped("amount_residual")))
+        self._log_results(results)
+
+    def test_benchmark_apply_credits(self):
+        results = []
+        for size in BENCHMARK_SIZES:
+            for label, currency in self._currencies():
+                with self.subTest(size=size, currency=label):
+                    partner = self._create_partner("Credit Benchmark %s %s" % (label, size))
+                    moves = self._create_invoices(partner, size, amount=100.0, currency=currency)
+                    credits = self._create_credits(partner, size, amount=50.0, currency=currency)
+                    wizard = self._create_wizard(partner, apply_all_credits=True)
+                    wizard._load_invoices()
+                    with self._measure("apply credits (%s currency)" % label, size) as result:
+                        wizard.action_apply_selected_payments()
+                    results.append(result)
+                    self.assertTrue(all(credits.mapped("reconciled")))
+                    self.assertAlmostEqual(sum(moves.mapped("amount_residual")), 50.0 * size, places=2)
+        self._log_results(results)
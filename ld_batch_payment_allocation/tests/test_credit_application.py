@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+
+from .common import BatchPaymentAllocationCommon
+
+
+@tagged("post_install", "-at_install")
+class TestBatchPaymentCreditApplication(BatchPaymentAllocationCommon):
+
+    def _apply_all_credits(self, partner, **vals):
+        wizard = self._create_wizard(partner, apply_all_credits=True, **vals)
+        wizard._load_invoices()
+        return wizard.action_apply_selected_payments()
+
+    def test_apply_credits_fifo(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 4, amount=100.0)
+        credits = self._create_credits(partner, 3, amount=50.0)
+        action = self._apply_all_credits(partner)
+
+        self.assertEqual(action["params"]["type"], "success")
+        self.assertTrue(all(credits.mapped("reconciled")))
+        # Oldest invoice first: 150 settles the first invoice and half the second
+        self.assertEqual(moves.mapped("amount_residual"), [0.0, 50.0, 100.0, 100.0])
+
+    def test_apply_refunds_as_credits(self):
+        for partner_type, invoice_type in (("customer", "out_invoice"), ("supplier", "in_invoice")):
+            with self.subTest(partner_type=partner_type):
+                partner = self._create_partner("Refund Credit %s" % partner_type)
+                invoices = self._create_invoices(partner, 2, amount=100.0, move_type=invoice_type)
+                refund = self._create_refunds(partner, 1, amount=40.0, partner_type=partner_type)
+                self._apply_all_credits(partner, partner_type=partner_type)
+
+                self.assertEqual(invoices.mapped("amount_residual"), [60.0, 100.0])
+                self.assertEqual(refund.amount_residual, 0.0)
+
+    def test_apply_credits_multi_currency(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 4, amount=100.0, currency=self.foreign_currency)
+        credits = self._create_credits(partner, 4, amount=50.0, currency=self.foreign_currency)
+        self._apply_all_credits(partner)
+
+        self.assertTrue(all(credits.mapped("reconciled")))
+        self.assertAlmostEqual(sum(moves.mapped("amount_residual")), 200.0)
+
+    def test_apply_credits_exact_amount(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 2, amount=100.0)
+        moves |= self._create_invoices(partner, 1, amount=70.0)
+        self._create_credits(partner, 1, amount=70.0)
+        self._apply_all_credits(partner, credit_matching="exact_amount")
+
+        self.assertEqual(moves.mapped("amount_residual"), [100.0, 100.0, 0.0])
+
+    def test_apply_credits_reference(self):
+        partner = self._create_partner()
+        moves = self._create_invoices(partner, 3, amount=100.0)
+        self._create_credits(partner, 1, amount=100.0, refs=["Refund %s" % moves[2].name])
+        self._apply_all_credits(partner, credit_matching="reference")
+
+        self.assertEqual(moves.mapped("amount_residual"), [100.0, 100.0, 0.0])
+
+    def test_query_count_bounded(self):
+        """Credit application reconciles in bulk: its cost per credit stays constant."""
+        results = {}
+        for size in (5, 25):
+            partner = self._create_partner("Credit Query Count Partner %s" % size)
+            self._create_invoices(partner, size, amount=100.0)
+            self._create_credits(partner, size, amount=50.0)
+            wizard = self._create_wizard(partner, apply_all_credits=True)
+            wizard._load_invoices()
+            with self._measure("apply credits", size) as result:
+                wizard.action_apply_selected_payments()
+            results[size] = result
+
+        self.assertQueriesBounded(results[5], results[25], per_record=15)
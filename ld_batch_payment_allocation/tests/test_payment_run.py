@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import BatchPaymentAllocationCommon, PAYMENT_DATE
+
+
+@tagged("post_install", "-at_install")
+class TestBatchPaymentRun(BatchPaymentAllocationCommon):
+
+    def _create_run(self, partners, **vals):
+        return self.env["batch.payment.run"].create(dict({
+            "partner_type": "customer",
+            "partner_ids": [(6, 0, partners.ids)],
+            "journal_id": self.bank_journal.id,
+            "payment_date": PAYMENT_DATE,
+            "chunk_size": 2,
+        }, **vals))
+
+    def test_run_pays_partners_in_cron(self):
+        partners = self._create_partner("Run Partner A") | self._create_partner("Run Partner B") \
+            | self._create_partner("Run Partner C")
+        moves = self.env["account.move"]
+        for partner in partners:
+            moves |= self._create_invoices(partner, 2, amount=100.0)
+        run = self._create_run(partners)
+        run.action_run()
+
+        # Starting a run only queues it; nothing is paid inside the request
+        self.assertEqual(run.state, "running")
+        self.assertEqual(set(run.line_ids.mapped("state")), {"pending"})
+        self.assertEqual(set(moves.mapped("amount_residual")), {100.0})
+        with self.assertRaises(UserError):
+            run.action_run()
+
+        self.env["batch.payment.run"]._cron_process_runs()
+        self.assertEqual(run.state, "done")
+        self.assertEqual(run.done_count, 3)
+        self.assertEqual(run.payment_count, 3)
+        self.assertEqual(set(moves.mapped("amount_residual")), {0.0})
+        with self.assertRaises(UserError):
+            run.action_run()
+
+    def test_run_skips_refunds(self):
+        for partner_type, invoice_type in (("customer", "out_invoice"), ("supplier", "in_invoice")):
+            for allocation_mode in ("grouped", "per_invoice"):
+                with self.subTest(partner_type=partner_type, allocation_mode=allocation_mode):
+                    partner = self._create_partner("Run Refund %s %s" % (partner_type, allocation_mode))
+                    invoices = self._create_invoices(partner, 2, amount=100.0, move_type=invoice_type)
+                    refund = self._create_refunds(partner, 1, amount=40.0, partner_type=partner_type)
+                    run = self._create_run(partner, partner_type=partner_type, allocation_mode=allocation_mode)
+                    run.action_prepare()
+                    self.assertEqual(run.line_ids.invoice_count, 2)
+
+                    run.action_run()
+                    self.env["batch.payment.run"]._cron_process_runs()
+                    self.assertEqual(run.state, "done")
+                    self.assertAlmostEqual(run.line_ids.amount, 200.0)
+                    self.assertEqual(set(invoices.mapped("amount_residual")), {0.0})
+                    self.assertAlmostEqual(refund.amount_residual, 40.0)
+
+    def test_run_resumes_after_time_budget(self):
+        partners = self._create_partner("Budget Partner A") | self._create_partner("Budget Partner B")
+        for partner in partners:
+            self._create_invoices(partner, 1, amount=100.0)
+        run = self._create_run(partners, chunk_size=1)
+        run.action_run()
+
+        self.patch(type(self.env["batch.payment.run"]), "_cron_time_budget", 0)
+        self.env["batch.payment.run"]._cron_process_runs()
+        self.assertEqual(run.state, "running")
+        self.assertEqual(set(run.line_ids.mapped("state")), {"pending"})
+
+        self.patch(type(self.env["batch.payment.run"]), "_cron_time_budget", 240)
+        self.env["batch.payment.run"]._cron_process_runs()
+        self.assertEqual(run.state, "done")
+        self.assertEqual(set(run.line_ids.mapped("state")), {"done"})
+
+    def test_run_chunk_error_fails_run(self):
+        partners = self._create_partner("Chunk Error Partner A") | self._create_partner("Chunk Error Partner B")
+        for partner in partners:
+            self._create_invoices(partner, 1, amount=100.0)
+        run = self._create_run(partners, chunk_size=1)
+        run.action_run()
+
+        Wizard = type(self.env["batch.payment.allocation.wizard"])
+        with patch.object(Wizard, "_get_residuals_by_move", side_effect=UserError("Chunk load failure")):
+            self.env["batch.payment.run"]._cron_process_runs()
+        # The failing chunk fails the run instead of leaving it running forever
+        self.assertEqual(run.state, "failed")
+        self.assertIn("Chunk load failure", run.error)
+        self.assertEqual(run.line_ids.mapped("state"), ["failed", "pending"])
+
+        run.action_run()
+        self.env["batch.payment.run"]._cron_process_runs()
+        self.assertEqual(run.state, "done")
+        self.assertFalse(run.error)
+        self.assertEqual(set(run.line_ids.mapped("state")), {"done"})
+
+    def test_run_checks_settings_before_queueing(self):
+        partner = self._create_partner()
+        self._create_invoices(partner, 1, amount=100.0, move_type="in_invoice")
+        journal = self.env["account.journal"].create({"name": "No Outbound Bank", "type": "bank", "code": "NOBK"})
+        journal.outbound_payment_method_line_ids.unlink()
+        run = self._create_run(partner, partner_type="supplier", journal_id=journal.id)
+
+        with self.assertRaises(UserError):
+            run.action_run()
+        self.assertEqual(run.state, "draft")
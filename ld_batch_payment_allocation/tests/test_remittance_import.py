@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import base64
+
+from odoo.tests import tagged
+
+from ..wizards.remittance_import_wizard import _parse_amount
+
+from .common import BatchPaymentAllocationCommon, PAYMENT_DATE
+
+CAMT054 = """<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.054.001.08">
+  <BkToCstmrDbtCdtNtfctn><Ntfctn>
+    <Ntry>
+      <Amt Ccy="USD">%(total)s</Amt>
+      <CdtDbtInd>CRDT</CdtDbtInd>
+      <NtryDtls><TxDtls>
+        <RltdPties>
+          <Dbtr><Pty><Nm>Customer</Nm><Id><OrgId><Othr><Id>%(debtor)s</Id></Othr></OrgId></Id></Pty></Dbtr>
+          <Cdtr><Pty><Nm>Us</Nm><Id><OrgId><Othr><Id>%(creditor)s</Id></Othr></OrgId></Id></Pty></Cdtr>
+        </RltdPties>
+        <RmtInf>%(documents)s</RmtInf>
+      </TxDtls></NtryDtls>
+    </Ntry>
+  </Ntfctn></BkToCstmrDbtCdtNtfctn>
+</Document>"""
+
+CAMT054_DOCUMENT = """<Strd><RfrdDocInf><Nb>%s</Nb></RfrdDocInf>
+<RfrdDocAmt><RmtdAmt Ccy="USD">%s</RmtdAmt></RfrdDocAmt></Strd>"""
+
+
+@tagged("post_install", "-at_install")
+class TestBatchPaymentRemittanceImport(BatchPaymentAllocationCommon):
+
+    def _import(self, content, **vals):
+        wizard = self.env["batch.payment.remittance.import"].create(dict({
+            "file": base64.b64encode(content.encode()),
+            "partner_type": "customer",
+            "journal_id": self.bank_journal.id,
+            "payment_date": PAYMENT_DATE,
+        }, **vals))
+        wizard.action_import()
+        return wizard
+
+    def test_parse_amount(self):
+        for text, separator, expected in (
+            ("1,234.56", ".", 1234.56),
+            ("1234.5", ".", 1234.5),
+            ("1,234,567", ".", 1234567.0),
+            ("1.234,56", ",", 1234.56),
+            ("1 234,5", ",", 1234.5),
+            ("60,00", ",", 60.0),
+            # The chosen separator decides: no guessing
+            ("1,234", ".", 1234.0),
+            ("1.234", ".", 1.234),
+            ("1.234", ",", 1234.0),
+            ("1,234", ",", 1.234),
+            # Wrong grouping or separator
+            ("1,5", ".", None),
+            ("1.5", ",", None),
+            ("1,234.56", ",", None),
+            ("12a", ".", None),
+            ("", ".", None),
+        ):
+            with self.subTest(text=text, separator=separator):
+                self.assertEqual(_parse_amount(text, separator), expected)
+
+    def test_import_csv_decimal_comma(self):
+        partner = self._create_partner()
+        partner.ref = "C001"
+        invoices = self._create_invoices(partner, 2, amount=100.0)
+        refund = self._create_refunds(partner, 1, amount=30.0)
+        content = "\n".join([
+            "partner;invoice;amount",
+            "C001;%s;60,00" % invoices[0].name,
+            "C001;%s;6,0,0" % invoices[0].name,
+            # 1234.00 with a decimal comma, clamped to the residual
+            "C001;%s;1.234" % invoices[1].name,
+            "C001;%s;30,00" % refund.name,
+            "C001;UNKNOWN;5,00",
+        ])
+        wizard = self._import(content, csv_delimiter=";", decimal_separator=",")
+
+        self.assertEqual((wizard.row_count, wizard.matched_count, wizard.unmatched_count), (5, 2, 3))
+        self.assertIn("invalid amount", wizard.unmatched_report)
+        self.assertEqual(invoices.mapped("amount_residual"), [40.0, 0.0])
+        # Refunds are never paid: they are not found among the payable invoices
+        self.assertAlmostEqual(refund.amount_residual, 30.0)
+        self.assertAlmostEqual(sum(wizard.payment_ids.mapped("amount")), 160.0)
+
+    def test_import_camt054_uses_debtor_of_credit(self):
+        customer = self._create_partner("Remitting Customer")
+        customer.ref = "C002"
+        # Creditor reference of another partner: matching on it would reject every row
+        self._create_partner("Own Company Partner").ref = "US01"
+        invoices = self._create_invoices(customer, 2, amount=100.0)
+        documents = CAMT054_DOCUMENT % (invoices[0].name, "100.00") + CAMT054_DOCUMENT % (invoices[1].name, "50.00")
+        wizard = self._import(CAMT054 % {"total": "150.00", "debtor": "C002", "creditor": "US01", "documents": documents},
+                              file_format="camt054")
+
+        self.assertEqual((wizard.matched_count, wizard.unmatched_count), (2, 0))
+        self.assertEqual(invoices.mapped("amount_residual"), [0.0, 50.0])
+        self.assertAlmostEqual(sum(wizard.payment_ids.mapped("amount")), 150.0)
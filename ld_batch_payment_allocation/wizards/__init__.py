@@ -1,3 +1,5 @@
 from . import batch_payment_wizard
 
 from . import unreconciled_payment_wizard
+from . import auto_allocation_wizard
+from . import remittance_import_wizard
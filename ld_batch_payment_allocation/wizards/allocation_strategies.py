@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Distribution of a target amount over invoice residuals.
+
+Every strategy works on ``rows``, a list of (key, residual) pairs already
+sorted in the order the strategy should consume them, with residual and
+target expressed in integer minor units of the payment currency (cents) so
+the results add up exactly. They return {key: allocated units}.
+"""
+import time
+from bisect import bisect_left
+
+
+def fill_in_order(rows, target):
+    """Pay each residual in turn until the target is used up."""
+    result = {}
+    remaining = target
+    for key, residual in rows:
+        if remaining <= 0:
+            break
+        amount = min(residual, remaining)
+        if amount > 0:
+            result[key] = amount
+            remaining -= amount
+    return result
+
+
+def proportional(rows, target):
+    """Spread the target in proportion to each residual (largest remainder rounding)."""
+    total = sum(residual for _key, residual in rows)
+    if total <= 0:
+        return {}
+    if target >= total:
+        return {key: residual for key, residual in rows if residual > 0}
+    result = {key: residual * target // total for key, residual in rows}
+    leftover = target - sum(result.values())
+    by_remainder = sorted(rows, key=lambda row: row[1] * target % total, reverse=True)
+    for key, _residual in by_remainder[:leftover]:
+        result[key] += 1
+    return {key: amount for key, amount in result.items() if amount > 0}
+
+
+def exact_subset(rows, target, time_limit):
+    """Find residuals summing exactly to ``target``; None if none is found in ``time_limit`` seconds.
+
+    Singles and pairs are resolved with hash lookups; larger subsets with a
+    depth-first branch and bound over residuals sorted largest first, pruned
+    with suffix sums and skipping equal residuals at the same depth.
+    """
+    items = sorted(((residual, key) for key, residual in rows if 0 < residual <= target),
+                   key=lambda item: item[0], reverse=True)
+    seen = {}
+    for residual, key in items:
+        if residual == target:
+            return {key: residual}
+        if target - residual in seen:
+            return {seen[target - residual]: target - residual, key: residual}
+        seen.setdefault(residual, key)
+
+    values = [residual for residual, _key in items]
+    negated = [-value for value in values]
+    n = len(values)
+    suffix = [0] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        suffix[i] = suffix[i + 1] + values[i]
+    if suffix[0] < target:
+        return None
+
+    deadline = time.monotonic() + time_limit
+    frames = [[0, target]]  # [next index to try, remaining amount]
+    chosen = []
+    nodes = 0
+    while frames:
+        nodes += 1
+        if not nodes % 2048 and time.monotonic() > deadline:
+            return None
+        frame = frames[-1]
+        i = max(frame[0], bisect_left(negated, -frame[1]))
+        remaining = frame[1]
+        if i >= n or suffix[i] < remaining:
+            frames.pop()
+            if chosen:
+                chosen.pop()
+            continue
+        value = values[i]
+        j = i + 1
+        while j < n and values[j] == value:
+            j += 1
+        frame[0] = j
+        chosen.append(i)
+        if value == remaining:
+            return {items[index][1]: values[index] for index in chosen}
+        frames.append([i + 1, remaining - value])
+    return None
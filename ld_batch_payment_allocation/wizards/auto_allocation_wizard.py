@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from odoo import fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools import float_round
+
+from . import allocation_strategies
+
+
+class BatchPaymentAllocationWizard(models.TransientModel):
+    _inherit = "batch.payment.allocation.wizard"
+
+    target_amount = fields.Monetary(string="Target Amount", currency_field="payment_currency_id",
+                                    help="Amount to distribute over the matching invoices, in payment currency.")
+    allocation_strategy = fields.Selection([
+        ("fifo", "Oldest First"),
+        ("due_date", "Due Date First"),
+        ("proportional", "Proportional"),
+        ("min_open", "Fewest Open Invoices"),
+        ("exact_subset", "Exact Match (Remittance)"),
+    ], string="Allocation Strategy", default="fifo", required=True)
+    subset_time_limit = fields.Float(string="Exact Match Time Limit (s)", default=2.0,
+                                     help="Maximum time spent searching invoices whose residuals add up to the target.")
+
+    def _get_strategy_rows(self):
+        """Return (moves, {move_id: residual in payment currency units}) for every matching invoice.
+
+        Only positive residuals are distributed: documents the partner owes
+        nothing on (e.g. refunds) never receive a share of the target.
+        """
+        self.ensure_one()
+        moves = self.env["account.move"].search_fetch(
+            self._get_invoice_domain(), ["name", "invoice_date", "invoice_date_due", "currency_id"],
+            order=self._invoice_order,
+        )
+        rounding = self._get_payment_currency().rounding
+        units = {}
+        for move, _amt, residual_paycur in self._clamp_to_residual_paycur([(mv, None) for mv in moves]):
+            residual_units = int(round(residual_paycur / rounding))
+            if residual_units > 0:
+                units[move.id] = residual_units
+        return moves.filtered(lambda m: m.id in units), units
+
+    def _run_allocation_strategy(self, moves, units, target):
+        """Distribute ``target`` (units) with the selected strategy: {move_id: units}."""
+        self.ensure_one()
+        strategy = self.allocation_strategy
+        if strategy == "due_date":
+            moves = moves.sorted(lambda m: (m.invoice_date_due or m.invoice_date or fields.Date.today(), m.name or "", m.id))
+        elif strategy == "min_open":
+            # Smallest residuals first closes the largest number of invoices
+            moves = moves.sorted(lambda m: (units[m.id], m.id))
+        rows = [(move.id, units[move.id]) for move in moves]
+
+        if strategy == "proportional":
+            return allocation_strategies.proportional(rows, target)
+        if strategy == "exact_subset":
+            result = allocation_strategies.exact_subset(rows, target, max(self.subset_time_limit, 0.1))
+            if result is None:
+                raise UserError(_("No combination of open invoices adds up exactly to %(amount)s (searched for %(seconds)s seconds).",
+                                  amount=self.target_amount, seconds=self.subset_time_limit))
+            return result
+        return allocation_strategies.fill_in_order(rows, target)
+
+    def _fill_allocated_lines(self, moves, amounts):
+        """Set amount_to_pay from ``amounts`` ({move_id: amount}); create lines for unloaded invoices.
+
+        Loaded lines are updated and missing ones created in a single write.
+        """
+        self.ensure_one()
+        commands = [(1, line.id, {"amount_to_pay": amounts.get(line.move_id.id, 0.0)}) for line in self.line_ids]
+        loaded = set(self.line_ids.move_id.ids)
+        missing = moves.filtered(lambda m: m.id in amounts and m.id not in loaded)
+        lines_vals = self._prepare_line_vals(missing)
+        for vals in lines_vals:
+            vals["amount_to_pay"] = amounts[vals["move_id"]]
+        commands += [(0, 0, vals) for vals in lines_vals]
+        if commands:
+            self.line_ids = commands
+
+    def action_auto_allocate(self):
+        self.ensure_one()
+        if not (self.partner_type and self.partner_id):
+            raise UserError(_("Please select a partner first."))
+        pay_currency = self._get_payment_currency()
+        if pay_currency.compare_amounts(self.target_amount, 0.0) <= 0:
+            raise UserError(_("Please set a positive Target Amount."))
+
+        moves, units = self._get_strategy_rows()
+        rounding = pay_currency.rounding
+        allocated = self._run_allocation_strategy(moves, units, int(round(self.target_amount / rounding)))
+        amounts = {move_id: float_round(amount * rounding, precision_rounding=rounding)
+                   for move_id, amount in allocated.items()}
+        self.select_all_matching = False
+        self._fill_allocated_lines(moves, amounts)
+        return self._reopen()
@@ -1,13 +1,37 @@
 # -*- coding: utf-8 -*-
+import uuid
+from collections import defaultdict
+
+import psycopg2.errors
+
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError, ValidationError
-from odoo.tools import float_compare
+from odoo.tools import SQL, float_compare
+
+from ..models.account_payment import BATCH_ALLOCATION_KEY, BATCH_CUSTOM_RATE_KEY
+from ..models.batch_payment_perf_log import perf_logged, perf_phase
+from .currency_converter import CurrencyConverter
+
+RECEIVABLE_PAYABLE = ("asset_receivable", "liability_payable")
+# Documents paid per partner type; refunds are netted as outstanding credits instead
+INVOICE_MOVE_TYPES = {"customer": ("out_invoice",), "supplier": ("in_invoice",)}
+
+# Selections shared by the wizard, payment runs, allocation jobs and remittance imports
+PARTNER_TYPES = [("customer", "Customer"), ("supplier", "Vendor")]
+ALLOCATION_MODES = [("grouped", "One Grouped Payment"), ("per_invoice", "One Payment per Invoice")]
+RATE_SOURCES = [("company", "Company Rates (res.currency.rate)"), ("custom", "Custom Rate")]
+CREDIT_MATCHINGS = [
+    ("fifo", "Oldest Invoice First"),
+    ("exact_amount", "Exact Amount, then Oldest"),
+    ("reference", "Reference, then Oldest"),
+]
+
 
 class BatchPaymentAllocationWizard(models.TransientModel):
     _name = "batch.payment.allocation.wizard"
     _description = "Batch Payment Allocation (One payment -> Many invoices)"
 
-    partner_type = fields.Selection([("customer","Customer"),("supplier","Vendor")], required=True, default="supplier")
+    partner_type = fields.Selection(PARTNER_TYPES, required=True, default="supplier")
     partner_id = fields.Many2one("res.partner", string="Partner", required=True, domain="[('parent_id','=',False)]")
     company_id = fields.Many2one("res.company", default=lambda self: self.env.company, required=True, readonly=True)
     journal_id = fields.Many2one("account.journal", string="Payment Journal", required=True, domain="[('type','in',('bank','cash'))]")
@@ -16,35 +40,110 @@ class BatchPaymentAllocationWizard(models.TransientModel):
     payment_currency_id = fields.Many2one("res.currency", string="Payment Currency", required=True, default=lambda self: self.env.company.currency_id)
     communication = fields.Char(string="Memo / Reference")
 
-    allocation_mode = fields.Selection([("grouped", "One Grouped Payment"), ("per_invoice", "One Payment per Invoice")],
-                                       default="grouped", required=True, string="Allocation Mode")
-    rate_source = fields.Selection([("company", "Company Rates (res.currency.rate)"), ("custom", "Custom Rate")],
-                                   default="company", required=True, string="FX Rate Source")
-    custom_rate = fields.Float(string="Custom Rate (1 Company CCY -> Payment CCY)", digits=(16, 6))
+    allocation_mode = fields.Selection(ALLOCATION_MODES, default="grouped", required=True, string="Allocation Mode")
+    lock_mode = fields.Selection([
+        ("none", "No Locking"),
+        ("skip_locked", "Skip Invoices Being Paid"),
+        ("nowait", "Stop if Invoices Are Being Paid"),
+    ], default="none", required=True, string="Concurrent Payments",
+        help="Lock the invoices before paying them so that two users cannot pay the same invoice at the same time. "
+             "Invoices being paid by another user are either skipped and reported, or stop the payment.")
+    allocation_key = fields.Char(default=lambda self: uuid.uuid4().hex, readonly=True, copy=False,
+                                 help="Stamped on the created payments to find them back and refuse paying twice.")
+    rate_source = fields.Selection(RATE_SOURCES, default="company", required=True, string="FX Rate Source")
+    custom_rate = fields.Float(string="Custom Rate (1 Company CCY -> Payment CCY)", digits=(16, 6),
+                               help="Converts the residuals and books the payments in company currency.")
 
     total_to_pay = fields.Monetary(string="Total to Pay", currency_field="payment_currency_id",
                                    compute="_compute_total_to_pay", store=False)
     line_ids = fields.One2many("batch.payment.allocation.wizard.line", "wizard_id", string="Invoices")
 
+    # Lazy loading: only loaded pages become wizard lines, the rest is aggregated in SQL
+    page_size = fields.Integer(string="Page Size", default=80,
+                               help="Number of invoices loaded per page. 0 loads every open invoice at once.")
+    loaded_count = fields.Integer(string="Loaded Invoices", readonly=True)
+    matching_count = fields.Integer(string="Matching Invoices", readonly=True)
+    matching_total = fields.Monetary(string="Matching Residual", currency_field="payment_currency_id", readonly=True)
+    matching_residual_company = fields.Float(readonly=True)
+    has_more = fields.Boolean(compute="_compute_has_more")
+    select_all_matching = fields.Boolean(string="Pay All Matching Invoices",
+                                         help="Pay every invoice matching the filters at its full residual, "
+                                              "including pages that were not loaded. Amounts typed on loaded lines are kept.")
+    filter_date_from = fields.Date(string="Invoice Date From")
+    filter_date_to = fields.Date(string="Invoice Date To")
+    filter_amount_min = fields.Float(string="Residual From")
+    filter_amount_max = fields.Float(string="Residual To")
+    filter_name = fields.Char(string="Document Number")
+
     # ---------- helpers ----------
     def _get_payment_currency(self):
         self.ensure_one()
         return self.journal_id.currency_id or self.company_id.currency_id
 
-    def _pay_to_company(self, amount_paycur, date):
+    def _get_fx_converter(self):
+        """Return a rate cache for this wizard's company and payment currency."""
+        self.ensure_one()
+        custom_rate = self.custom_rate if self.rate_source == "custom" else 0.0
+        return CurrencyConverter(self.env, self.company_id, self._get_payment_currency(), custom_rate)
+
+    def _pay_to_company(self, amount_paycur, date, fx=None):
         """Convert amount from payment/journal currency -> company currency."""
+        fx = fx or self._get_fx_converter()
         pay_currency = self._get_payment_currency()
         company_currency = self.company_id.currency_id
-        return pay_currency._convert(amount_paycur or 0.0, company_currency, self.company_id, date or fields.Date.context_today(self))
+        return fx.convert(amount_paycur or 0.0, pay_currency, company_currency, date or fields.Date.context_today(self))
 
-    def _convert_amount(self, amount_company_ccy, date):
+    def _get_payment_context(self):
+        """Context of the payments this wizard creates: its allocation key and,
+        with a custom rate, the rate their company currency balance is booked at."""
+        self.ensure_one()
+        context = {BATCH_ALLOCATION_KEY: self.allocation_key}
+        pay_currency = self._get_payment_currency()
+        if self.rate_source == "custom" and self.custom_rate > 0 and pay_currency != self.company_id.currency_id:
+            context[BATCH_CUSTOM_RATE_KEY] = (pay_currency.id, self.custom_rate)
+        return context
+
+    def _get_invoice_move_types(self):
+        """Move types the wizard pays. Refunds are not paid in cash: they stay
+        outstanding credits, netted against invoices by the credit matching."""
+        self.ensure_one()
+        return INVOICE_MOVE_TYPES[self.partner_type or "supplier"]
+
+    def _get_residual_sign(self):
+        """Sign turning a receivable/payable residual into the amount owed in the
+        wizard's payment direction: receivables are debits, payables credits."""
+        self.ensure_one()
+        return -1 if self.partner_type == "supplier" else 1
+
+    @api.model
+    def _prepare_settings_vals(self, settings, partner):
+        """Values of a wizard paying ``partner`` with the payment settings of
+        ``settings``: a payment run, an allocation job or a remittance import."""
+        return {
+            "partner_type": settings.partner_type,
+            "partner_id": partner.id,
+            "company_id": settings.company_id.id,
+            "journal_id": settings.journal_id.id,
+            "payment_method_line_id": settings.payment_method_line_id.id,
+            "payment_date": settings.payment_date,
+            "payment_currency_id": (settings.journal_id.currency_id or settings.company_id.currency_id).id,
+            "communication": settings.communication,
+            "allocation_mode": settings.allocation_mode,
+        }
+
+    def _perf_phase(self, name):
+        """Context manager timing ``name`` in the performance log (no-op when disabled)."""
+        return perf_phase(self, name)
+
+    def _convert_amount(self, amount_company_ccy, date, fx=None):
         """Convert from company currency -> payment/journal currency."""
         self.ensure_one()
         if not amount_company_ccy:
             return 0.0
+        fx = fx or self._get_fx_converter()
         pay_currency = self._get_payment_currency()
-        return self.company_id.currency_id._convert(amount_company_ccy, pay_currency, self.company_id,
-                                                    date or self.payment_date or fields.Date.context_today(self))
+        return fx.convert(amount_company_ccy, self.company_id.currency_id, pay_currency,
+                          date or self.payment_date or fields.Date.context_today(self))
 
     # ---------- onchange ----------
     @api.onchange("journal_id")
@@ -52,181 +151,510 @@ class BatchPaymentAllocationWizard(models.TransientModel):
         for w in self:
             if not w.journal_id:
                 continue
+            previous_currency = w.payment_currency_id
             w.payment_currency_id = w.journal_id.currency_id or w.company_id.currency_id
             methods = (w.journal_id.inbound_payment_method_line_ids if w.partner_type == "customer"
                        else w.journal_id.outbound_payment_method_line_ids)
             if not w.payment_method_line_id or (w.payment_method_line_id.journal_id != w.journal_id):
                 w.payment_method_line_id = methods[:1].id if methods else False
-            w._load_invoices()
+            w._reconvert_lines(previous_currency)
 
-    @api.onchange("partner_type", "partner_id", "payment_date")
+    @api.onchange("partner_type", "partner_id")
     def _onchange_partner(self):
         for w in self:
             w._load_invoices()
 
+    @api.onchange("payment_date", "rate_source", "custom_rate")
+    def _onchange_conversion(self):
+        for w in self:
+            w._reconvert_lines()
+
     # ---------- load invoices ----------
-    def _load_invoices(self):
+    _invoice_order = "invoice_date asc, name asc, id asc"
+
+    def _get_invoice_domain(self, apply_filters=True):
         self.ensure_one()
-        self.line_ids = [(5, 0, 0)]
-        if not (self.partner_type and self.partner_id):
-            return
-        in_types = ("out_invoice","out_refund") if self.partner_type == "customer" else ("in_invoice","in_refund")
-        moves = self.env["account.move"].search([
-            ("move_type", "in", in_types),
+        domain = [
+            ("move_type", "in", self._get_invoice_move_types()),
             ("partner_id", "=", self.partner_id.id),
             ("state", "=", "posted"),
             ("payment_state", "in", ("not_paid", "partial")),
             ("company_id", "=", self.company_id.id),
-        ], order="invoice_date asc, name asc")
+        ]
+        if not apply_filters:
+            return domain
+        if self.filter_date_from:
+            domain.append(("invoice_date", ">=", self.filter_date_from))
+        if self.filter_date_to:
+            domain.append(("invoice_date", "<=", self.filter_date_to))
+        if self.filter_amount_min:
+            domain.append(("amount_residual", ">=", self.filter_amount_min))
+        if self.filter_amount_max:
+            domain.append(("amount_residual", "<=", self.filter_amount_max))
+        if self.filter_name:
+            domain.append(("name", "ilike", self.filter_name))
+        return domain
+
+    def _get_matching_totals(self):
+        """Return (count, residual owed in company currency) of every matching
+        invoice, aggregated in a single row whatever the number of invoices."""
+        self.ensure_one()
+        [(count, residual)] = self.env["account.move"]._read_group(
+            self._get_invoice_domain(), groupby=[],
+            aggregates=["__count", "amount_residual_signed:sum"],
+        )
+        # amount_residual_signed is negative on vendor bills, like their payable lines
+        return count, self._get_residual_sign() * (residual or 0.0)
+
+    def _get_residuals_by_move(self, moves):
+        """Return {move_id: (residual_company, residual_invoice)} summed over the
+        receivable/payable lines of ``moves`` with a single grouped query.
+
+        Residuals are signed by the wizard's payment direction: positive for
+        what is still owed on an invoice or vendor bill, negative for a refund,
+        which the clamping then never pays.
+        """
+        self.ensure_one()
+        if not moves:
+            return {}
+        sign = self._get_residual_sign()
+        groups = self.env["account.move.line"]._read_group(
+            [("move_id", "in", moves.ids), ("account_id.account_type", "in", RECEIVABLE_PAYABLE)],
+            groupby=["move_id"],
+            aggregates=["amount_residual:sum", "amount_residual_currency:sum"],
+        )
+        return {
+            move.id: (sign * (residual_company or 0.0), sign * (residual_currency or 0.0))
+            for move, residual_company, residual_currency in groups
+        }
 
-        lines = []
+    def _prepare_line_vals(self, moves):
+        """Build wizard line values for ``moves`` in one pass over the grouped residuals."""
+        self.ensure_one()
+        with self._perf_phase("residuals") as phase:
+            residuals = self._get_residuals_by_move(moves)
+            phase.line_count = len(residuals)
+        rows = []
         for mv in moves:
-            # Use receivable/payable lines to compute residuals
-            rec_lines = mv.line_ids.filtered(lambda l: l.account_id and l.account_id.account_type in ('asset_receivable','liability_payable'))
-            residual_company = sum(rec_lines.mapped('amount_residual'))
-            residual_invoice = sum(rec_lines.mapped('amount_residual_currency')) if mv.currency_id else residual_company
+            residual_company, residual_invoice = residuals.get(mv.id, (0.0, 0.0))
+            if not mv.currency_id:
+                residual_invoice = residual_company
             if residual_company == 0 and residual_invoice == 0:
                 continue
-            residual_pay_cur = self._convert_amount(residual_company, self.payment_date)
-            lines.append((0, 0, {
+            rows.append((mv, residual_company, residual_invoice))
+
+        # One rate lookup converts the whole residual vector
+        with self._perf_phase("fx conversion") as phase:
+            residuals_pay_cur = self._get_fx_converter().convert_many(
+                [residual_company for _mv, residual_company, _residual_invoice in rows],
+                self.company_id.currency_id, self._get_payment_currency(),
+                self.payment_date or fields.Date.context_today(self),
+            )
+            phase.line_count = len(rows)
+        vals_list = []
+        for (mv, residual_company, residual_invoice), residual_pay_cur in zip(rows, residuals_pay_cur):
+            vals_list.append({
                 "move_id": mv.id,
                 "name": mv.name,
                 "invoice_date": mv.invoice_date,
                 "residual_in_company_currency": residual_company,
                 "residual_in_invoice_currency": residual_invoice,
                 "residual_in_payment_currency": residual_pay_cur,
-                "amount_to_pay": residual_pay_cur,
-            }))
-        self.line_ids = lines
+                # Nothing is paid by default on a move owed the other way
+                "amount_to_pay": max(residual_pay_cur, 0.0),
+            })
+        return vals_list
 
-    # ---------- compute ----------
-    @api.depends("line_ids.amount_to_pay")
-    def _compute_total_to_pay(self):
-        for w in self:
-            w.total_to_pay = sum(w.line_ids.mapped("amount_to_pay"))
+    @perf_logged("load")
+    def _load_invoices(self):
+        """Reset the lines, aggregate every matching invoice and load the first page."""
+        self.ensure_one()
+        self.line_ids = [(5, 0, 0)]
+        self.loaded_count = 0
+        self.matching_count = 0
+        self.matching_total = 0.0
+        self.matching_residual_company = 0.0
+        if not (self.partner_type and self.partner_id):
+            return
+        with self._perf_phase("aggregates") as phase:
+            count, residual_company = self._get_matching_totals()
+            self.matching_count = count
+            self.matching_residual_company = residual_company
+            self.matching_total = self._convert_amount(residual_company, self.payment_date)
+            phase.line_count = count
+        self._load_next_page()
+
+    def _load_next_page(self):
+        """Append the next page of matching invoices to the lines."""
+        self.ensure_one()
+        with self._perf_phase("invoice search") as phase:
+            moves = self.env["account.move"].search_fetch(
+                self._get_invoice_domain(), ["name", "invoice_date", "currency_id"],
+                offset=self.loaded_count, limit=self.page_size if self.page_size > 0 else None,
+                order=self._invoice_order,
+            )
+            phase.line_count = len(moves)
+        self.loaded_count += len(moves)
+        # Invoices added out of page order (e.g. by auto-allocation) are already lines
+        present = set(self.line_ids.move_id.ids)
+        moves = moves.filtered(lambda m: m.id not in present)
+        lines_vals = self._prepare_line_vals(moves)
+        with self._perf_phase("line creation") as phase:
+            self.line_ids = [(0, 0, vals) for vals in lines_vals]
+            phase.line_count = len(lines_vals)
+
+    def _reconvert_lines(self, previous_currency=None):
+        """Re-convert the loaded residuals after a date, journal or rate change.
+
+        Only the currency conversion runs again, on the company residuals the
+        lines already hold: no invoice is re-read. Amounts still equal to the
+        old residual follow the new one. Amounts the user typed are kept, and
+        converted from ``previous_currency`` when the payment currency changed.
+        """
+        self.ensure_one()
+        fx = self._get_fx_converter()
+        company_currency = self.company_id.currency_id
+        pay_currency = self._get_payment_currency()
+        previous_currency = previous_currency or pay_currency
+        date = self.payment_date or fields.Date.context_today(self)
+        lines = self.line_ids
+        residuals_pay_cur = fx.convert_many(lines.mapped("residual_in_company_currency"), company_currency, pay_currency, date)
+        for line, residual_pay_cur in zip(lines, residuals_pay_cur):
+            if float_compare(line.amount_to_pay, line.residual_in_payment_currency,
+                             precision_rounding=previous_currency.rounding) == 0:
+                line.amount_to_pay = residual_pay_cur
+            elif previous_currency != pay_currency:
+                line.amount_to_pay = fx.convert(line.amount_to_pay, previous_currency, pay_currency, date)
+            line.residual_in_payment_currency = residual_pay_cur
+        self.matching_total = fx.convert(self.matching_residual_company, company_currency, pay_currency, date)
+
+    def _reopen(self):
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "views": [(False, "form")],
+            "target": "new",
+        }
 
-    # ---------- actions ----------
-    def action_allocate(self):
+    def action_load_more(self):
         self.ensure_one()
-        if not self.line_ids:
-            raise UserError(_("There are no invoice lines to pay."))
-        if not self.journal_id:
-            raise UserError(_("Please select a Payment Journal."))
+        self._load_next_page()
+        return self._reopen()
 
-        if not self.payment_method_line_id:
-            method = (self.journal_id.inbound_payment_method_line_ids if self.partner_type == "customer"
-                      else self.journal_id.outbound_payment_method_line_ids)[:1]
-            if not method:
-                raise UserError(_("The selected journal has no compatible payment method."))
-            self.payment_method_line_id = method.id
+    def action_apply_filters(self):
+        self.ensure_one()
+        self._load_invoices()
+        return self._reopen()
 
-        pay_currency = self._get_payment_currency()
-        date = self.payment_date or fields.Date.context_today(self)
+    # ---------- compute ----------
+    @api.depends("line_ids.amount_to_pay", "select_all_matching", "matching_total")
+    def _compute_total_to_pay(self):
+        for w in self:
+            if w.select_all_matching:
+                # Start from the SQL aggregate of every matching invoice and only
+                # add the difference typed on loaded lines
+                total = w.matching_total
+                for line in w.line_ids:
+                    total += line.amount_to_pay - line.residual_in_payment_currency
+            else:
+                total = sum(line.amount_to_pay for line in w.line_ids)
+            w.total_to_pay = total
 
-        chosen = self.line_ids.filtered(lambda l: l.amount_to_pay and l.amount_to_pay > 0.0)
-        if not chosen:
-            raise UserError(_("Please set a positive Amount to Pay for at least one invoice."))
+    @api.depends("loaded_count", "matching_count")
+    def _compute_has_more(self):
+        for w in self:
+            w.has_more = w.loaded_count < w.matching_count
 
-        def _clamp_to_residual_paycur(line, amt_in_pay_currency):
-            # Compare the user-entered amount (in payment/journal currency) with the residual in that same currency.
-            rec_lines = line.move_id.line_ids.filtered(lambda l: l.account_id and l.account_id.account_type in ('asset_receivable','liability_payable'))
-            pay_currency = self._get_payment_currency()
-            company_currency = self.company_id.currency_id
-            invoice_currency = line.move_id.currency_id
+    # ---------- allocation ----------
+    def _get_allocation_items(self):
+        """Return the (move, amount in payment currency) pairs to pay.
 
-            # Compute residual in payment currency
-            if invoice_currency and invoice_currency == pay_currency:
+        An amount of None requests the full residual; it is used for matching
+        invoices that were never loaded when ``select_all_matching`` is set.
+        """
+        self.ensure_one()
+        items = [(line.move_id, line.amount_to_pay) for line in self.line_ids
+                 if line.amount_to_pay and line.amount_to_pay > 0.0]
+        if self.select_all_matching:
+            loaded = set(self.line_ids.move_id.ids)
+            moves = self.env["account.move"].search(self._get_invoice_domain(), order=self._invoice_order)
+            items += [(mv, None) for mv in moves if mv.id not in loaded]
+        return items
+
+    def _clamp_to_residual_paycur(self, items, date=None, fx=None, residuals=None):
+        """Clamp requested amounts to the residual of each invoice, in payment currency.
+
+        Returns a list of (move, amount_paycur, residual_paycur) built from a
+        single grouped residual read and one converter for all items. Callers
+        that already hold ``_get_residuals_by_move`` results may pass them.
+        """
+        self.ensure_one()
+        date = date or self.payment_date or fields.Date.context_today(self)
+        fx = fx or self._get_fx_converter()
+        pay_currency = self._get_payment_currency()
+        company_currency = self.company_id.currency_id
+        if residuals is None:
+            moves = self.env["account.move"].browse([move.id for move, _amount in items])
+            residuals = self._get_residuals_by_move(moves)
+
+        result = []
+        for move, amount in items:
+            residual_company, residual_invoice = residuals.get(move.id, (0.0, 0.0))
+            if move.currency_id and move.currency_id == pay_currency:
                 # Perfect: use residual in invoice currency directly to avoid FX drift
-                residual_paycur = sum(rec_lines.mapped('amount_residual_currency'))
+                residual_paycur = residual_invoice
             else:
                 # Convert company residual to payment currency at the payment date
-                residual_company = sum(rec_lines.mapped('amount_residual'))
-                residual_paycur = company_currency._convert(residual_company, pay_currency, self.company_id, date)
+                residual_paycur = fx.convert(residual_company, company_currency, pay_currency, date)
 
-            amt_paycur = amt_in_pay_currency or 0.0
+            amt_paycur = residual_paycur if amount is None else (amount or 0.0)
             if float_compare(amt_paycur, residual_paycur, precision_rounding=pay_currency.rounding) > 0:
                 amt_paycur = residual_paycur
             if float_compare(amt_paycur, 0.0, precision_rounding=pay_currency.rounding) < 0:
                 amt_paycur = 0.0
-            return amt_paycur, residual_paycur
+            result.append((move, amt_paycur, residual_paycur))
+        return result
+
+    def _get_payment_method_line(self, payment_type):
+        """Return the wizard's payment method if it fits ``payment_type``, else the journal's first one."""
+        self.ensure_one()
+        if self.payment_method_line_id.payment_type == payment_type:
+            return self.payment_method_line_id
+        return (self.journal_id.inbound_payment_method_line_ids if payment_type == "inbound"
+                else self.journal_id.outbound_payment_method_line_ids)[:1]
 
+    def _get_payment_type(self):
+        """Direction of the payments: money comes in from customers and goes out to vendors."""
+        self.ensure_one()
+        return "inbound" if self.partner_type == "customer" else "outbound"
+
+    def _prepare_payment_vals(self, move, amount_paycur, date, destination_account):
+        """Values of the account.payment paying ``amount_paycur`` of invoice ``move``."""
+        self.ensure_one()
+        payment_type = self._get_payment_type()
+        vals = {
+            "date": date,
+            "amount": amount_paycur,
+            "payment_type": payment_type,
+            "partner_type": self.partner_type,
+            "partner_id": move.commercial_partner_id.id,
+            "currency_id": self._get_payment_currency().id,
+            "journal_id": self.journal_id.id,
+            "company_id": self.company_id.id,
+            "payment_method_line_id": self._get_payment_method_line(payment_type).id,
+            "destination_account_id": destination_account.id,
+            "memo": self.communication or move.payment_reference or move.name,
+            "invoice_ids": [(4, move.id)],
+        }
+        # Like the register: pay vendors to the bill's bank account; inbound payments
+        # keep the bank account account.payment proposes from the journal
+        if payment_type == "outbound":
+            vals["partner_bank_id"] = move.partner_bank_id.id
+        return vals
+
+    def _create_payments_bulk(self, allocations, date):
+        """Create, post and reconcile one payment per invoice in bulk.
+
+        ``allocations`` is the output of ``_clamp_to_residual_paycur``. The
+        payments are created with a single ``create()``, posted together and
+        reconciled against their invoice lines in one reconciliation plan.
+        Returns exactly the created payments.
+
+        Unlike account.payment.register, this path offers no payment
+        difference write-off: as with the register's default, a partial
+        amount leaves the invoice open. Invoices eligible for an early
+        payment discount, which only the register computes, are paid
+        through the register one by one.
+        """
+        self.ensure_one()
+        pay_currency = self._get_payment_currency()
+        allocations = [(move, amt_paycur) for move, amt_paycur, _res in allocations
+                       if float_compare(amt_paycur, 0.0, precision_rounding=pay_currency.rounding) > 0]
+        if not allocations:
+            return self.env["account.payment"]
+
+        discounted = [(move, amt_paycur) for move, amt_paycur in allocations
+                      if move._is_eligible_for_early_payment_discount(pay_currency, date)]
+        register_payments = self.env["account.payment"]
+        for move, amt_paycur in discounted:
+            register_payments |= self._create_register_payments(move, amt_paycur, date)
+        allocations = [allocation for allocation in allocations if allocation not in discounted]
+        if not allocations:
+            return register_payments
+
+        # Open receivable/payable lines of all invoices, read once
+        AccountMoveLine = self.env["account.move.line"]
+        with self._perf_phase("invoice lines read") as phase:
+            open_lines = AccountMoveLine.search_fetch([
+                ("move_id", "in", [move.id for move, _amt in allocations]),
+                ("account_id.account_type", "in", RECEIVABLE_PAYABLE),
+                ("reconciled", "=", False),
+            ], ["move_id", "account_id"])
+            phase.line_count = len(open_lines)
+        line_ids_by_move = defaultdict(list)
+        for aml in open_lines:
+            line_ids_by_move[aml.move_id.id].append(aml.id)
+
+        allocations = [(move, amt_paycur, AccountMoveLine.browse(line_ids_by_move[move.id]))
+                       for move, amt_paycur in allocations if line_ids_by_move[move.id]]
+        vals_list = [self._prepare_payment_vals(move, amt_paycur, date, inv_lines.account_id[:1])
+                     for move, amt_paycur, inv_lines in allocations]
+        with self._perf_phase("payment create") as phase:
+            payments = self.env["account.payment"].with_context(**self._get_payment_context()).create(vals_list)
+            phase.line_count = len(payments)
+        with self._perf_phase("payment post") as phase:
+            payments.action_post()
+            phase.line_count = len(payments)
+
+        plan = []
+        for payment, (_move, _amt, inv_lines) in zip(payments, allocations):
+            pay_lines = payment.move_id.line_ids.filtered(
+                lambda l: l.account_id in inv_lines.account_id and not l.reconciled)
+            if pay_lines:
+                plan.append(pay_lines + inv_lines)
+        if plan:
+            with self._perf_phase("reconcile") as phase:
+                AccountMoveLine._reconcile_plan(plan)
+                phase.line_count = len(plan)
+        return register_payments | payments
+
+    def _create_grouped_payment(self, allocations, date):
+        """Create one payment for all ``allocations`` through account.payment.register."""
+        self.ensure_one()
+        pay_currency = self._get_payment_currency()
+        total_amount = sum(amt_paycur for _move, amt_paycur, _res in allocations)  # in pay currency
+        if float_compare(total_amount, 0.0, precision_rounding=pay_currency.rounding) <= 0:
+            return self.env["account.payment"]
+
+        moves = self.env["account.move"].browse([move.id for move, _amt, _res in allocations])
+        return self._create_register_payments(moves, total_amount, date)
+
+    def _create_register_payments(self, moves, amount_paycur, date):
+        """Pay ``amount_paycur`` of ``moves`` with one account.payment.register, as one payment."""
+        self.ensure_one()
+        with self._perf_phase("payment register") as phase:
+            reg = self.env["account.payment.register"].with_context(
+                active_model="account.move", active_ids=moves.ids, **self._get_payment_context()
+            ).create({
+                "payment_date": date,
+                "journal_id": self.journal_id.id,
+                "payment_method_line_id": self.payment_method_line_id.id,
+                "currency_id": self._get_payment_currency().id,  # display currency
+                "amount": amount_paycur,        # amount in company currency (Odoo 19)
+                "group_payment": True,
+                "communication": self.communication or "",
+            })
+            phase.line_count = len(moves)
+        with self._perf_phase("payment create, post and reconcile") as phase:
+            existing = self._get_allocated_payments()
+            payments = reg._create_payments()
+            if not payments:
+                reg.action_create_payments()
+                payments = self._get_allocated_payments() - existing
+            phase.line_count = len(moves)
+        return payments
+
+    def _get_allocated_payments(self):
+        """Payments already created by this wizard, found by its allocation key."""
+        self.ensure_one()
+        if not self.allocation_key:
+            return self.env["account.payment"]
+        return self.env["account.payment"].search([("batch_allocation_key", "=", self.allocation_key)])
+
+    def _get_open_lines_sql(self, move_ids, lock=None):
+        """SELECT (aml id, move id) of the open receivable/payable lines of ``move_ids``.
+
+        With ``lock`` ("skip_locked" or "nowait") the lines are locked in id
+        order, so concurrent allocations always lock in the same order.
+        """
+        lock_clause = {
+            "skip_locked": SQL("FOR UPDATE OF aml SKIP LOCKED"),
+            "nowait": SQL("FOR UPDATE OF aml NOWAIT"),
+        }.get(lock, SQL())
+        return SQL("""
+            SELECT aml.id, aml.move_id
+              FROM account_move_line aml
+              JOIN account_account account ON account.id = aml.account_id
+             WHERE aml.move_id IN %s
+               AND account.account_type IN %s
+               AND aml.reconciled IS NOT TRUE
+          ORDER BY aml.id
+               %s
+        """, tuple(move_ids), RECEIVABLE_PAYABLE, lock_clause)
+
+    def _lock_allocation_items(self, items):
+        """Lock the receivable/payable lines of the invoices in ``items`` for this transaction.
+
+        Returns (items that are locked, invoices held by another transaction).
+        With ``nowait`` an invoice held elsewhere raises a UserError instead.
+
+        Odoo runs transactions at REPEATABLE READ: the residuals read afterwards
+        come from this transaction's snapshot, not from the latest commit. They
+        are current nonetheless, because FOR UPDATE on a line that another
+        transaction changed and committed after the snapshot raises a
+        serialization failure. That error is deliberately not caught: it
+        aborts the transaction and Odoo retries the whole request on a fresh
+        snapshot.
+        """
+        self.ensure_one()
+        moves = self.env["account.move"].browse([move.id for move, _amount in items])
+        if not moves:
+            return items, moves
+        AccountMoveLine = self.env["account.move.line"]
+        AccountMoveLine.flush_model(["move_id", "account_id", "reconciled"])
+        cr = self.env.cr
+        cr.execute(self._get_open_lines_sql(moves.ids))
+        expected = cr.fetchall()
+        try:
+            with cr.savepoint(flush=False):
+                cr.execute(self._get_open_lines_sql(moves.ids, lock=self.lock_mode))
+                locked = {aml_id for aml_id, _move_id in cr.fetchall()}
+        except psycopg2.errors.LockNotAvailable:
+            raise UserError(_("Some of the selected invoices are being paid by another user. "
+                              "Try again in a moment or skip the invoices being paid."))
+
+        held_ids = {move_id for aml_id, move_id in expected if aml_id not in locked}
+        return ([(move, amount) for move, amount in items if move.id not in held_ids],
+                moves.filtered(lambda m: m.id in held_ids))
+
+    def _allocate(self, allocations, date):
+        """Create the payments for clamped ``allocations`` according to the allocation mode.
+
+        Only invoices of the wizard's direction are paid: a refund reaching
+        this point is dropped rather than refunded in cash.
+        """
+        self.ensure_one()
+        invoice_types = self._get_invoice_move_types()
+        allocations = [allocation for allocation in allocations if allocation[0].move_type in invoice_types]
+        pay_currency = self._get_payment_currency()
         # If grouped but mixed currencies, fallback to per-invoice
-        mismatch = any(l.move_id.currency_id and l.move_id.currency_id != pay_currency for l in chosen)
+        mismatch = any(move.currency_id and move.currency_id != pay_currency for move, _amt, _res in allocations)
         if self.allocation_mode == "grouped" and mismatch:
             self.allocation_mode = "per_invoice"
 
         if self.allocation_mode == "per_invoice":
-            payment_ids = []
-            for line in chosen:
-                amt_paycur, _res = _clamp_to_residual_paycur(line, line.amount_to_pay or 0.0)
-
-                reg = self.env["account.payment.register"].with_context(
-                    active_model="account.move", active_ids=[line.move_id.id]
-                ).create({
-                    "payment_date": date,
-                    "journal_id": self.journal_id.id,
-                    "payment_method_line_id": self.payment_method_line_id.id,
-                    "currency_id": pay_currency.id,  # display currency
-                    "amount": amt_paycur,           # amount is in company currency (Odoo 19)
-                    "group_payment": False,
-                    "communication": self.communication or "",
-                })
-                payments = reg._create_payments()
-                if not payments:
-                    reg.action_create_payments()
-                    payments = self.env["account.payment"].search([
-                        ("partner_id", "=", self.partner_id.id),
-                        ("journal_id", "=", self.journal_id.id),
-                        ("date", "=", date),
-                    ], order="id desc", limit=1)
-                payment_ids += payments.ids
-
-            if not payment_ids:
-                raise UserError(_("No payments were created. Check the amounts to pay."))
-
-            return {
-                'type': 'ir.actions.act_window',
-                'res_model': 'account.payment',
-                'view_mode': 'list,form',
-                'views': [(False, 'list'), (False, 'form')],
-                'domain': [('id', 'in', payment_ids)],
-                'name': _('Payments'),
-                'target': 'current',
-            }
-
+            return self._create_payments_bulk(allocations, date)
         # Grouped payment (all invoices compatible with journal currency)
-        total_amount = 0.0  # in pay currency
-        for line in chosen:
-            amt_paycur, _res = _clamp_to_residual_paycur(line, line.amount_to_pay or 0.0)
-            total_amount += amt_paycur
+        return self._create_grouped_payment(allocations, date)
 
-        if float_compare(total_amount, 0.0, precision_rounding=self._get_payment_currency().rounding) <= 0:
-            raise UserError(_("No payments were created. Check the amounts to pay."))
+    def _check_allocation_settings(self):
+        """Validate the journal, payment method and rate settings before paying."""
+        self.ensure_one()
+        if not self.journal_id:
+            raise UserError(_("Please select a Payment Journal."))
 
-        move_ids = chosen.mapped("move_id").ids
-        reg = self.env["account.payment.register"].with_context(
-            active_model="account.move", active_ids=move_ids
-        ).create({
-            "payment_date": date,
-            "journal_id": self.journal_id.id,
-            "payment_method_line_id": self.payment_method_line_id.id,
-            "currency_id": pay_currency.id,  # display currency
-            "amount": total_amount,         # amount in company currency (Odoo 19)
-            "group_payment": True,
-            "communication": self.communication or "",
-        })
-        payments = reg._create_payments()
-        if not payments:
-            reg.action_create_payments()
-            payments = self.env["account.payment"].search([
-                ("partner_id", "=", self.partner_id.id),
-                ("journal_id", "=", self.journal_id.id),
-                ("date", "=", date),
-            ], order='id desc', limit=1)
+        if not self.payment_method_line_id:
+            method = self._get_payment_method_line(self._get_payment_type())
+            if not method:
+                raise UserError(_("The selected journal has no compatible payment method."))
+            self.payment_method_line_id = method.id
 
-        if not payments:
-            raise UserError(_("No payments were created. Check the amounts to pay."))
+        if self.rate_source == "custom" and self.custom_rate <= 0:
+            raise UserError(_("Please set a positive Custom Rate or use the company rates."))
 
+    def _action_open_payments(self, payments):
         return {
             'type': 'ir.actions.act_window',
             'res_model': 'account.payment',
@@ -237,6 +665,95 @@ class BatchPaymentAllocationWizard(models.TransientModel):
             'target': 'current',
         }
 
+    def _prepare_job_vals(self):
+        """Snapshot of the wizard settings for a background allocation job."""
+        self.ensure_one()
+        return {
+            "partner_type": self.partner_type,
+            "partner_id": self.partner_id.id,
+            "company_id": self.company_id.id,
+            "journal_id": self.journal_id.id,
+            "payment_method_line_id": self.payment_method_line_id.id,
+            "payment_date": self.payment_date,
+            "communication": self.communication,
+            "allocation_mode": self.allocation_mode,
+            "rate_source": self.rate_source,
+            "custom_rate": self.custom_rate,
+            "credit_matching": self.credit_matching,
+        }
+
+    # ---------- actions ----------
+    @perf_logged("allocate")
+    def action_allocate(self):
+        self.ensure_one()
+        # A second click on the same wizard opens the payments instead of paying twice
+        existing = self._get_allocated_payments()
+        if existing:
+            return self._action_open_payments(existing)
+        if not self.line_ids and not self.select_all_matching:
+            raise UserError(_("There are no invoice lines to pay."))
+        self._check_allocation_settings()
+        date = self.payment_date or fields.Date.context_today(self)
+
+        with self._perf_phase("invoice search") as phase:
+            items = self._get_allocation_items()
+            phase.line_count = len(items)
+        if not items:
+            raise UserError(_("Please set a positive Amount to Pay for at least one invoice."))
+        skipped = self.env["account.move"]
+        if self.lock_mode != "none":
+            with self._perf_phase("lock") as phase:
+                items, skipped = self._lock_allocation_items(items)
+                phase.line_count = len(items)
+        with self._perf_phase("fx conversion") as phase:
+            allocations = self._clamp_to_residual_paycur(items, date=date)
+            phase.line_count = len(allocations)
+        if self.lock_mode != "none":
+            # Locked lines are unchanged since the snapshot (see _lock_allocation_items):
+            # an invoice with nothing left was settled before this transaction started
+            pay_currency = self._get_payment_currency()
+            skipped |= self.env["account.move"].browse(
+                [move.id for move, _amt, residual in allocations if pay_currency.is_zero(residual)])
+            allocations = [allocation for allocation in allocations if allocation[0] not in skipped]
+            if not allocations:
+                raise UserError(_("All the selected invoices are being paid or were already paid by another user."))
+
+        payments = self._allocate(allocations, date)
+        if not payments:
+            raise UserError(_("No payments were created. Check the amounts to pay."))
+        action = self._action_open_payments(payments)
+        if skipped:
+            return {
+                "type": "ir.actions.client",
+                "tag": "display_notification",
+                "params": {
+                    "title": _("Invoices Skipped"),
+                    "message": _("%(count)s invoices were being paid or were already paid by another user and were skipped: %(names)s",
+                                 count=len(skipped), names=", ".join(skipped.mapped("name"))),
+                    "type": "warning",
+                    "sticky": True,
+                    "next": action,
+                },
+            }
+        return action
+
+    def action_allocate_async(self):
+        """Snapshot the chosen lines into a background job processed by ir.cron."""
+        self.ensure_one()
+        if not self.line_ids and not self.select_all_matching:
+            raise UserError(_("There are no invoice lines to pay."))
+        self._check_allocation_settings()
+        items = self._get_allocation_items()
+        if not items:
+            raise UserError(_("Please set a positive Amount to Pay for at least one invoice."))
+        job = self.env["batch.payment.allocation.job"].create(dict(
+            self._prepare_job_vals(),
+            job_type="allocate",
+            line_ids=[(0, 0, {"move_id": move.id, "amount": amount or 0.0, "pay_full_residual": amount is None})
+                      for move, amount in items],
+        ))
+        return job._action_open()
+
 
 class BatchPaymentAllocationWizardLine(models.TransientModel):
     _name = "batch.payment.allocation.wizard.line"
@@ -260,9 +777,9 @@ class BatchPaymentAllocationWizardLine(models.TransientModel):
             rec.name = rec.move_id.name or ""
             rec.invoice_date = rec.move_id.invoice_date
             if rec.move_id:
-                rec_lines = rec.move_id.line_ids.filtered(lambda l: l.account_id and l.account_id.account_type in ('asset_receivable','liability_payable'))
-                residual_company = sum(rec_lines.mapped('amount_residual'))
-                residual_invoice = sum(rec_lines.mapped('amount_residual_currency')) if rec.move_id.currency_id else residual_company
+                residual_company, residual_invoice = rec.wizard_id._get_residuals_by_move(rec.move_id).get(rec.move_id.id, (0.0, 0.0))
+                if not rec.move_id.currency_id:
+                    residual_invoice = residual_company
                 rec.residual_in_company_currency = residual_company
                 rec.residual_in_invoice_currency = residual_invoice
                 rec.residual_in_payment_currency = rec.wizard_id._convert_amount(residual_company, rec.wizard_id.payment_date)
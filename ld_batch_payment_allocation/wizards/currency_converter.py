@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+
+class CurrencyConverter:
+    """Memoized currency conversion for one company.
+
+    Each rate is resolved once per (from_currency, to_currency, company, date)
+    and reused for every amount converted afterwards, so converting thousands
+    of residuals costs a single rate lookup per currency pair. Rounding follows
+    ``res.currency._convert``: the result is rounded with the target currency.
+
+    When ``custom_rate`` is set (1 company currency -> ``payment_currency``),
+    conversions between the company and payment currencies use it directly
+    and never query ``res.currency.rate``.
+    """
+
+    def __init__(self, env, company, payment_currency=None, custom_rate=0.0):
+        self.env = env
+        self.company = company
+        self.payment_currency = payment_currency
+        self.custom_rate = custom_rate or 0.0
+        self._rates = {}
+
+    def _resolve_rate(self, from_currency, to_currency, date):
+        company_currency = self.company.currency_id
+        if self.custom_rate > 0 and self.payment_currency:
+            if from_currency == company_currency and to_currency == self.payment_currency:
+                return self.custom_rate
+            if from_currency == self.payment_currency and to_currency == company_currency:
+                return 1.0 / self.custom_rate
+        return self.env["res.currency"]._get_conversion_rate(from_currency, to_currency, self.company, date)
+
+    def rate(self, from_currency, to_currency, date):
+        if from_currency == to_currency:
+            return 1.0
+        key = (from_currency.id, to_currency.id, self.company.id, date)
+        if key not in self._rates:
+            self._rates[key] = self._resolve_rate(from_currency, to_currency, date)
+        return self._rates[key]
+
+    def convert(self, amount, from_currency, to_currency, date, round=True):
+        if not amount:
+            return 0.0
+        amount = amount * self.rate(from_currency, to_currency, date)
+        return to_currency.round(amount) if round else amount
+
+    def convert_many(self, amounts, from_currency, to_currency, date, round=True):
+        """Convert a sequence of amounts with a single rate lookup."""
+        rate = self.rate(from_currency, to_currency, date)
+        if not round:
+            return [(amount or 0.0) * rate for amount in amounts]
+        to_round = to_currency.round
+        return [to_round(amount * rate) if amount else 0.0 for amount in amounts]
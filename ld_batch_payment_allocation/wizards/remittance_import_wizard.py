@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+import base64
+import csv
+import io
+import logging
+import re
+import time
+from collections import defaultdict
+from itertools import chain, islice
+from xml.etree.ElementTree import iterparse
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools import float_round
+
+from .batch_payment_wizard import ALLOCATION_MODES, INVOICE_MOVE_TYPES, PARTNER_TYPES
+
+_logger = logging.getLogger(__name__)
+
+# Unmatched rows kept for the report; the counters keep counting past it
+UNMATCHED_REPORT_LIMIT = 1000
+
+CSV_COLUMNS = {
+    "partner": ("partner", "partner_ref", "partner reference", "customer", "vendor", "vat"),
+    "invoice": ("invoice", "invoice_number", "invoice number", "number", "document", "reference"),
+    "amount": ("amount", "paid", "amount_paid", "amount paid"),
+}
+
+# Amounts with optional thousands grouping, by decimal separator
+AMOUNT_PATTERNS = {
+    ".": re.compile(r"^[+-]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?$"),
+    ",": re.compile(r"^[+-]?(?:\d{1,3}(?:\.\d{3})+|\d+)(?:,\d+)?$"),
+}
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find_text(element, *path):
+    """Text of the first descendant following ``path`` (local tag names), ignoring namespaces."""
+    nodes = [element]
+    for name in path:
+        nodes = [child for node in nodes for child in node.iter() if child is not node and _local(child.tag) == name]
+        if not nodes:
+            return None
+    return (nodes[0].text or "").strip() or None
+
+
+def _child_text(element, name):
+    """Text of the direct child ``name`` (local tag name) of ``element``."""
+    for child in element:
+        if _local(child.tag) == name:
+            return (child.text or "").strip() or None
+    return None
+
+
+def _parse_amount(text, decimal_separator="."):
+    """Value of ``text`` written with ``decimal_separator``; None when it is not a valid amount.
+
+    The other separator is only accepted as a thousands separator grouping
+    three digits: with a decimal comma "1.234" is 1234.0 and "1.5" is invalid.
+    """
+    text = (text or "").replace(" ", "").replace("\xa0", "")
+    if not AMOUNT_PATTERNS[decimal_separator].match(text):
+        return None
+    thousands = "," if decimal_separator == "." else "."
+    return float(text.replace(thousands, "").replace(decimal_separator, "."))
+
+
+class BatchPaymentRemittanceImport(models.TransientModel):
+    _name = "batch.payment.remittance.import"
+    _description = "Remittance Advice Import (File -> Batch Payments)"
+
+    file = fields.Binary(string="Remittance File", required=True)
+    filename = fields.Char()
+    file_format = fields.Selection([("csv", "CSV"), ("camt054", "camt.054 (ISO 20022 XML)")],
+                                   string="Format", default="csv", required=True)
+    csv_delimiter = fields.Char(string="CSV Delimiter", default=",", size=1)
+    decimal_separator = fields.Selection([(".", "Point (1,234.56)"), (",", "Comma (1.234,56)")],
+                                         string="Decimal Separator", default=".", required=True,
+                                         help="Decimal separator of the CSV amounts; camt.054 amounts always use a point.")
+    chunk_size = fields.Integer(string="Rows per Chunk", default=1000, required=True,
+                                help="Rows resolved against the database with one lookup.")
+
+    partner_type = fields.Selection(PARTNER_TYPES, required=True, default="customer")
+    company_id = fields.Many2one("res.company", default=lambda self: self.env.company, required=True, readonly=True)
+    journal_id = fields.Many2one("account.journal", string="Payment Journal", required=True, domain="[('type','in',('bank','cash'))]")
+    payment_method_line_id = fields.Many2one("account.payment.method.line", string="Payment Method", domain="[('journal_id','=',journal_id)]")
+    payment_date = fields.Date(default=fields.Date.context_today, required=True)
+    communication = fields.Char(string="Memo / Reference")
+    allocation_mode = fields.Selection(ALLOCATION_MODES, default="grouped", required=True, string="Allocation Mode")
+    run_in_background = fields.Boolean(string="Pay in Background",
+                                       help="Create one background allocation job per partner instead of paying right away.")
+
+    state = fields.Selection([("draft", "Draft"), ("done", "Done")], default="draft", required=True)
+    row_count = fields.Integer(string="Rows", readonly=True)
+    matched_count = fields.Integer(string="Matched", readonly=True)
+    unmatched_count = fields.Integer(string="Unmatched", readonly=True)
+    partner_count = fields.Integer(string="Partners", readonly=True)
+    parse_duration = fields.Float(string="Parse and Match (s)", digits=(16, 3), readonly=True)
+    allocation_duration = fields.Float(string="Allocation (s)", digits=(16, 3), readonly=True)
+    rows_per_second = fields.Float(string="Rows/s", digits=(16, 1), readonly=True)
+    unmatched_report = fields.Text(string="Unmatched Rows", readonly=True)
+    payment_ids = fields.Many2many("account.payment", string="Payments", readonly=True)
+    job_ids = fields.Many2many("batch.payment.allocation.job", string="Jobs", readonly=True)
+
+    @api.onchange("filename")
+    def _onchange_filename(self):
+        if self.filename and self.filename.lower().endswith(".xml"):
+            self.file_format = "camt054"
+        elif self.filename:
+            self.file_format = "csv"
+
+    # ---------- parsing ----------
+    def _open_file(self):
+        """Binary stream on the uploaded file, read from the attachment store.
+
+        The base64 payload is only decoded in memory when the file is not
+        stored as a file system attachment.
+        """
+        self.ensure_one()
+        attachment = self.env["ir.attachment"].sudo().search([
+            ("res_model", "=", self._name), ("res_field", "=", "file"), ("res_id", "=", self.id),
+        ], limit=1)
+        if attachment.store_fname:
+            return open(attachment._full_path(attachment.store_fname), "rb")
+        return io.BytesIO(attachment.raw if attachment else base64.b64decode(self.file))
+
+    def _iter_csv_rows(self, stream):
+        """Yield (line number, partner ref, invoice number, amount) from a CSV stream.
+
+        A header row naming the columns is used when present, otherwise the
+        columns are read as partner reference, invoice number, amount.
+        """
+        reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""),
+                            delimiter=self.csv_delimiter or ",")
+        first = next(reader, None)
+        if first is None:
+            return
+        header = [cell.strip().lower() for cell in first]
+        positions = {key: next((header.index(alias) for alias in aliases if alias in header), None)
+                     for key, aliases in CSV_COLUMNS.items()}
+        start = 2
+        if positions["invoice"] is None or positions["amount"] is None:
+            # No recognizable header: the first row is data
+            positions = {"partner": 0, "invoice": 1, "amount": 2}
+            reader = chain([first], reader)
+            start = 1
+        for line_no, row in enumerate(reader, start=start):
+            if not any(cell.strip() for cell in row):
+                continue
+            def _cell(key):
+                index = positions[key]
+                return row[index].strip() if index is not None and index < len(row) else ""
+            yield line_no, _cell("partner"), _cell("invoice"), _cell("amount")
+
+    def _iter_camt054_rows(self, stream):
+        """Yield rows from a camt.054 notification, one per referred document.
+
+        The XML is parsed incrementally and every transaction and entry element
+        is detached from its parent once read, so memory stays flat whatever
+        the file size.
+
+        The counterparty is the debtor of a credit (money received) and the
+        creditor of a debit, as given by ``CdtDbtInd`` on the transaction or
+        its entry; without indicator it follows the partner type.
+        """
+        default_party = "Dbtr" if self.partner_type == "customer" else "Cdtr"
+        parents = []
+        entry = None
+        line_no = 0
+        for event, element in iterparse(stream, events=("start", "end")):
+            if event == "start":
+                if _local(element.tag) == "Ntry":
+                    entry = element
+                parents.append(element)
+                continue
+            parents.pop()
+            tag = _local(element.tag)
+            if tag not in ("TxDtls", "Ntry"):
+                continue
+            if tag == "TxDtls":
+                line_no += 1
+                yield from self._camt054_transaction_rows(line_no, element, entry, default_party)
+            if parents:
+                parents[-1].remove(element)
+
+    def _camt054_transaction_rows(self, line_no, element, entry, default_party):
+        """Rows of one camt.054 ``TxDtls`` element, see ``_iter_camt054_rows``."""
+        indicator = _child_text(element, "CdtDbtInd") or (_child_text(entry, "CdtDbtInd") if entry is not None else None)
+        party = {"CRDT": "Dbtr", "DBIT": "Cdtr"}.get(indicator, default_party)
+        partner_ref = (_find_text(element, "RltdPties", party, "Othr", "Id")
+                       or _find_text(element, "RltdPties", party, "Nm") or "")
+        documents = [node for node in element.iter() if _local(node.tag) == "Strd"]
+        found = False
+        for structured in documents:
+            number = _find_text(structured, "RfrdDocInf", "Nb")
+            if not number:
+                continue
+            found = True
+            amount = (_find_text(structured, "RfrdDocAmt", "RmtdAmt")
+                      or _find_text(structured, "RfrdDocAmt", "DuePyblAmt")
+                      or (_find_text(element, "Amt") if len(documents) == 1 else None))
+            yield line_no, partner_ref, number, amount or ""
+        if not found:
+            yield line_no, partner_ref, _find_text(element, "RmtInf", "Ustrd") or "", _find_text(element, "Amt") or ""
+
+    def _iter_rows(self):
+        with self._open_file() as stream:
+            if self.file_format == "camt054":
+                yield from self._iter_camt054_rows(stream)
+            else:
+                yield from self._iter_csv_rows(stream)
+
+    # ---------- matching ----------
+    def _get_move_types(self):
+        """Only invoices are paid; refunds stay outstanding credits."""
+        return INVOICE_MOVE_TYPES[self.partner_type]
+
+    def _get_decimal_separator(self):
+        # camt.054 amounts are xs:decimal values
+        return "." if self.file_format == "camt054" else self.decimal_separator
+
+    def _match_chunk(self, rows):
+        """Resolve a chunk of rows with one invoice lookup and one partner lookup.
+
+        Returns (matched [(partner_id, move_id, amount)], unmatched [(line_no, row, reason)]).
+        """
+        numbers = {invoice for _line_no, _partner_ref, invoice, _amount in rows if invoice}
+        refs = {partner_ref for _line_no, partner_ref, _invoice, _amount in rows if partner_ref}
+        moves = self.env["account.move"].search_fetch([
+            ("name", "in", list(numbers)),
+            ("move_type", "in", self._get_move_types()),
+            ("state", "=", "posted"),
+            ("company_id", "=", self.company_id.id),
+        ], ["name", "commercial_partner_id", "payment_state"]) if numbers else self.env["account.move"]
+        moves_by_name = {move.name: move for move in moves}
+        partners_by_ref = {}
+        if refs:
+            partners = self.env["res.partner"].search_fetch(
+                ["|", ("ref", "in", list(refs)), ("vat", "in", list(refs))], ["ref", "vat", "commercial_partner_id"])
+            for partner in partners:
+                for key in (partner.ref, partner.vat):
+                    if key in refs:
+                        partners_by_ref[key] = partner.commercial_partner_id.id
+
+        rounding = (self.journal_id.currency_id or self.company_id.currency_id).rounding
+        decimal_separator = self._get_decimal_separator()
+        matched, unmatched = [], []
+        for line_no, partner_ref, invoice, amount in rows:
+            row = (partner_ref, invoice, amount)
+            amount = _parse_amount(amount, decimal_separator)
+            if amount is None:
+                unmatched.append((line_no, row, _("invalid amount")))
+                continue
+            amount = float_round(amount, precision_rounding=rounding)
+            move = moves_by_name.get(invoice)
+            if not move:
+                unmatched.append((line_no, row, _("invoice not found")))
+            elif move.payment_state not in ("not_paid", "partial"):
+                unmatched.append((line_no, row, _("invoice already paid")))
+            elif partner_ref in partners_by_ref and partners_by_ref[partner_ref] != move.commercial_partner_id.id:
+                unmatched.append((line_no, row, _("partner does not match the invoice")))
+            elif amount <= 0:
+                unmatched.append((line_no, row, _("amount is not positive")))
+            else:
+                matched.append((move.commercial_partner_id.id, move.id, amount))
+        return matched, unmatched
+
+    # ---------- allocation ----------
+    def _allocate_partner(self, partner_id, amounts):
+        """Pay ``amounts`` ({move_id: amount}) of one partner with the allocation wizard logic."""
+        Wizard = self.env["batch.payment.allocation.wizard"]
+        wizard = Wizard.create(Wizard._prepare_settings_vals(self, self.env["res.partner"].browse(partner_id)))
+        wizard._check_allocation_settings()
+        moves = self.env["account.move"].browse(list(amounts))
+        if self.run_in_background:
+            job = self.env["batch.payment.allocation.job"].create(dict(
+                wizard._prepare_job_vals(),
+                job_type="allocate",
+                line_ids=[(0, 0, {"move_id": move.id, "amount": amounts[move.id]}) for move in moves],
+            ))
+            return self.env["account.payment"], job
+        date = self.payment_date or fields.Date.context_today(self)
+        allocations = wizard._clamp_to_residual_paycur([(move, amounts[move.id]) for move in moves], date=date)
+        return wizard._allocate(allocations, date), self.env["batch.payment.allocation.job"]
+
+    def action_import(self):
+        self.ensure_one()
+        if not self.with_context(bin_size=True).file:
+            raise UserError(_("Please select a remittance file."))
+        start = time.perf_counter()
+        amounts_by_partner = defaultdict(lambda: defaultdict(float))
+        row_count = matched_count = unmatched_count = 0
+        report = []
+        rows = self._iter_rows()
+        try:
+            while True:
+                chunk = list(islice(rows, max(self.chunk_size, 1)))
+                if not chunk:
+                    break
+                row_count += len(chunk)
+                matched, unmatched = self._match_chunk(chunk)
+                for partner_id, move_id, amount in matched:
+                    amounts_by_partner[partner_id][move_id] += amount
+                matched_count += len(matched)
+                unmatched_count += len(unmatched)
+                for line_no, row, reason in unmatched[:max(UNMATCHED_REPORT_LIMIT - len(report), 0)]:
+                    report.append(_("Row %(line)s %(row)s: %(reason)s", line=line_no, row=" | ".join(row), reason=reason))
+        except (csv.Error, SyntaxError, UnicodeDecodeError) as e:
+            raise UserError(_("The remittance file could not be read: %s", e))
+        finally:
+            rows.close()
+        parse_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        payments = self.env["account.payment"]
+        jobs = self.env["batch.payment.allocation.job"]
+        for partner_id, amounts in amounts_by_partner.items():
+            try:
+                with self.env.cr.savepoint():
+                    partner_payments, partner_jobs = self._allocate_partner(partner_id, amounts)
+                payments |= partner_payments
+                jobs |= partner_jobs
+            except UserError as e:
+                _logger.info("Remittance allocation failed for partner %s: %s", partner_id, e)
+                if len(report) < UNMATCHED_REPORT_LIMIT:
+                    report.append(_("Partner %(partner)s: %(error)s",
+                                    partner=self.env["res.partner"].browse(partner_id).display_name, error=e))
+
+        if unmatched_count > len(report):
+            report.append(_("... %s more unmatched rows not listed.", unmatched_count - len(report)))
+        self.write({
+            "state": "done",
+            "row_count": row_count,
+            "matched_count": matched_count,
+            "unmatched_count": unmatched_count,
+            "partner_count": len(amounts_by_partner),
+            "parse_duration": parse_duration,
+            "allocation_duration": time.perf_counter() - start,
+            "rows_per_second": row_count / parse_duration if parse_duration else 0.0,
+            "unmatched_report": "\n".join(report),
+            "payment_ids": [(6, 0, payments.ids)],
+            "job_ids": [(6, 0, jobs.ids)],
+        })
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "views": [(False, "form")],
+            "target": "new",
+        }
+
+    def action_open_payments(self):
+        self.ensure_one()
+        return self.env["batch.payment.allocation.wizard"]._action_open_payments(self.payment_ids)
+
+    def action_open_jobs(self):
+        self.ensure_one()
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": "batch.payment.allocation.job",
+            "view_mode": "list,form",
+            "views": [(False, "list"), (False, "form")],
+            "domain": [("id", "in", self.job_ids.ids)],
+            "name": _("Allocation Jobs"),
+        }
@@ -1,5 +1,15 @@
 # -*- coding: utf-8 -*-
+import logging
+import re
+from collections import defaultdict
+
 from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from ..models.batch_payment_perf_log import perf_logged
+from .batch_payment_wizard import CREDIT_MATCHINGS, RECEIVABLE_PAYABLE
+
+_logger = logging.getLogger(__name__)
 
 class BatchPaymentAllocationWizard(models.TransientModel):
     _inherit = "batch.payment.allocation.wizard"
@@ -9,66 +19,226 @@ class BatchPaymentAllocationWizard(models.TransientModel):
         string="Unreconciled Credits/Payments", readonly=False,
         help="Outstanding receivable/payable lines (payments, credit notes, etc.) for this partner that can be assigned to invoices."
     )
+    credit_matching = fields.Selection(CREDIT_MATCHINGS, string="Credit Matching", default="fifo", required=True)
+
+    credit_page_size = fields.Integer(string="Credits per Page", default=200,
+                                      help="Outstanding items loaded per page. 0 loads every item at once.")
+    credit_count = fields.Integer(string="Outstanding Items", readonly=True)
+    credit_loaded_count = fields.Integer(string="Loaded Items", readonly=True)
+    credit_has_more = fields.Boolean(compute="_compute_credit_has_more")
+    apply_all_credits = fields.Boolean(string="Apply All Outstanding Items",
+                                       help="Apply every outstanding item of the partner, including pages that were not loaded.")
+
+    @api.depends("credit_loaded_count", "credit_count")
+    def _compute_credit_has_more(self):
+        for wiz in self:
+            wiz.credit_has_more = wiz.credit_loaded_count < wiz.credit_count
+
+    def _get_credit_domain(self):
+        self.ensure_one()
+        # Resolve the commercial entity's contacts once instead of joining res.partner per line
+        partner_ids = self.env["res.partner"].with_context(active_test=False)._search(
+            [("commercial_partner_id", "=", self.partner_id.commercial_partner_id.id)])
+        domain = [
+            ("partner_id", "in", partner_ids),
+            ("company_id", "=", self.company_id.id),
+            ("account_id.account_type", "in", RECEIVABLE_PAYABLE),
+            ("reconciled", "=", False),
+            ("amount_residual", "!=", 0.0),
+        ]
+        if self.partner_type:
+            # Exclude every open invoice of the partner, loaded as a line or not
+            domain.append(("move_id", "not any", self._get_invoice_domain(apply_filters=False)))
+        return domain
+
+    def _load_credit_page(self):
+        """Append the next page of outstanding items, read with one search_fetch."""
+        self.ensure_one()
+        amls = self.env["account.move.line"].search_fetch(
+            self._get_credit_domain(),
+            ["date", "move_name", "ref", "journal_id", "partner_id", "currency_id",
+             "amount_residual", "amount_residual_currency"],
+            offset=self.credit_loaded_count,
+            limit=self.credit_page_size if self.credit_page_size > 0 else None,
+            order="date asc, id asc",
+        )
+        self.credit_loaded_count += len(amls)
+        company_currency = self.company_id.currency_id
+        lines_vals = []
+        for aml in amls:
+            available_company = abs(aml.amount_residual)
+            if company_currency.is_zero(available_company):
+                continue
+            currency = aml.currency_id or company_currency
+            lines_vals.append((0, 0, {
+                "aml_id": aml.id,
+                "date": aml.date,
+                "move_name": aml.move_name or aml.ref,
+                "journal_id": aml.journal_id.id,
+                "partner_id": aml.partner_id.id,
+                "company_currency_id": company_currency.id,
+                "currency_id": currency.id,
+                "available_company": available_company,
+                "available_currency": abs(aml.amount_residual_currency) if currency != company_currency else available_company,
+            }))
+        if lines_vals:
+            self.unreconciled_payment_line_ids = lines_vals
 
     @api.onchange("partner_id", "partner_type", "company_id")
     def _onchange_partner_unreconciled(self):
         for wiz in self:
             wiz.unreconciled_payment_line_ids = [(5, 0, 0)]
+            wiz.credit_count = 0
+            wiz.credit_loaded_count = 0
             if not wiz.partner_id or not wiz.company_id:
                 continue
-            aml_domain = [
-                ("partner_id.commercial_partner_id", "=", wiz.partner_id.commercial_partner_id.id),
-                ("company_id", "=", wiz.company_id.id),
-                ("account_id.account_type", "in", ("asset_receivable", "liability_payable")),
-                ("reconciled", "=", False),
-            ]
-            invoice_moves = wiz.line_ids.mapped("move_id").ids
-            if invoice_moves:
-                aml_domain.append(("move_id", "not in", invoice_moves))
-
-            aml_records = self.env["account.move.line"].search(aml_domain, order="date asc, id asc")
-            lines_vals = []
-            for aml in aml_records:
-                residual_company = abs(aml.amount_residual)
-                if wiz.company_id.currency_id.is_zero(residual_company):
-                    continue
-                vals = {
-                    "aml_id": aml.id,
-                    "date": aml.date,
-                    "move_name": aml.move_id.name or aml.move_id.ref,
-                    "journal_id": aml.move_id.journal_id.id,
-                    "partner_id": aml.partner_id.id,
-                    "company_currency_id": aml.company_id.currency_id.id,
-                    "currency_id": aml.currency_id.id or aml.company_id.currency_id.id,
-                }
-                lines_vals.append((0, 0, vals))
-            if lines_vals:
-                wiz.unreconciled_payment_line_ids = lines_vals
+            wiz.credit_count = self.env["account.move.line"].search_count(wiz._get_credit_domain())
+            wiz._load_credit_page()
+
+    def action_load_more_credits(self):
+        self.ensure_one()
+        self._load_credit_page()
+        return self._reopen()
+
+    def _get_selected_credits(self):
+        """Outstanding items to apply: the loaded ones, or all of them with ``apply_all_credits``."""
+        self.ensure_one()
+        if self.apply_all_credits:
+            return self.env["account.move.line"].search(self._get_credit_domain(), order="date asc, id asc")
+        return self.unreconciled_payment_line_ids.aml_id
+
+    def _compute_credit_assignment(self, credits, invoices):
+        """Plan which invoice line each outstanding credit settles, in memory.
+
+        Invoices are consumed in the given order (oldest first). Depending on
+        ``credit_matching``, a first pass pairs credits with an invoice of the
+        exact same residual or whose number appears in the credit reference.
+        Returns a list of (credit line, invoice line, amount in company currency).
+        """
+        self.ensure_one()
+        AccountMoveLine = self.env["account.move.line"]
+        currency = self.company_id.currency_id
+        order = {move_id: index for index, move_id in enumerate(invoices.ids)}
+        inv_lines = AccountMoveLine.search_fetch([
+            ("move_id", "in", invoices.ids),
+            ("parent_state", "=", "posted"),
+            ("account_id.account_type", "in", RECEIVABLE_PAYABLE),
+            ("reconciled", "=", False),
+        ], ["move_id", "account_id", "amount_residual"])
+        inv_lines = inv_lines.sorted(lambda l: (order[l.move_id.id], l.id))
+        credits = credits.filtered(lambda c: not c.reconciled)
+        credits.fetch(["account_id", "amount_residual", "name", "ref"])
 
+        remaining = {l.id: l.amount_residual for l in inv_lines | credits}
+        lines_by_account = defaultdict(list)
+        for line in inv_lines:
+            lines_by_account[line.account_id.id].append(line)
+
+        plan = []
+
+        def _assign(credit, inv_line):
+            credit_rem, inv_rem = remaining[credit.id], remaining[inv_line.id]
+            # Only opposite signs offset each other
+            if currency.is_zero(credit_rem) or currency.is_zero(inv_rem) or (credit_rem > 0) == (inv_rem > 0):
+                return
+            amount = min(abs(credit_rem), abs(inv_rem))
+            remaining[credit.id] += amount if credit_rem < 0 else -amount
+            remaining[inv_line.id] += amount if inv_rem < 0 else -amount
+            plan.append((credit, inv_line, amount))
+
+        if self.credit_matching == "exact_amount":
+            by_amount = defaultdict(list)
+            for line in inv_lines:
+                by_amount[(line.account_id.id, currency.round(abs(line.amount_residual)))].append(line)
+            for credit in credits:
+                for inv_line in by_amount.get((credit.account_id.id, currency.round(abs(credit.amount_residual))), []):
+                    if currency.compare_amounts(abs(remaining[inv_line.id]), abs(remaining[credit.id])) == 0:
+                        _assign(credit, inv_line)
+                        break
+        elif self.credit_matching == "reference":
+            by_name = defaultdict(list)
+            for line in inv_lines:
+                for key in (line.move_id.name, line.move_id.payment_reference):
+                    if key:
+                        by_name[(line.account_id.id, key.strip().lower())].append(line)
+            for credit in credits:
+                text = " ".join(filter(None, [credit.ref, credit.name, credit.move_id.ref, credit.move_id.payment_reference]))
+                for token in re.split(r"[\s,;]+", text.lower()):
+                    for inv_line in by_name.get((credit.account_id.id, token), []):
+                        _assign(credit, inv_line)
+
+        # FIFO for whatever is left
+        for credit in credits:
+            for inv_line in lines_by_account[credit.account_id.id]:
+                if currency.is_zero(remaining[credit.id]):
+                    break
+                _assign(credit, inv_line)
+        return plan
+
+    def _apply_credits(self, credits, invoices):
+        """Reconcile outstanding ``credits`` (account.move.line) with ``invoices``.
+
+        The assignment is computed in memory first, then reconciled with one
+        reconciliation plan per account. Each account runs in its own savepoint
+        so a failure only discards that account's reconciliations.
+        Returns (number of reconciled pairs, number of failed pairs).
+        """
+        with self._perf_phase("matching") as phase:
+            plan = self._compute_credit_assignment(credits, invoices)
+            phase.line_count = len(plan)
+        pairs_by_account = defaultdict(list)
+        for credit, inv_line, _amount in plan:
+            pairs_by_account[credit.account_id].append(credit + inv_line)
+
+        AccountMoveLine = self.env["account.move.line"]
+        applied = failed = 0
+        for account, pairs in pairs_by_account.items():
+            try:
+                with self._perf_phase("reconcile") as phase, self.env.cr.savepoint():
+                    AccountMoveLine._reconcile_plan(pairs)
+                    phase.line_count = len(pairs)
+                applied += len(pairs)
+            except Exception:
+                _logger.exception("Could not apply credits on account %s", account.display_name)
+                failed += len(pairs)
+        return applied, failed
+
+    def _get_credit_invoices(self):
+        """Invoices that receive credits: lines with a positive amount, oldest first."""
+        self.ensure_one()
+        inv_lines = self.line_ids.sorted(key=lambda l: (l.invoice_date or l.move_id.invoice_date or False, l.name or ""))
+        return inv_lines.filtered(lambda l: l.amount_to_pay and l.amount_to_pay > 0).move_id
+
+    @perf_logged("apply_credits")
     def action_apply_selected_payments(self):
+        applied = failed = 0
         for wiz in self:
-            inv_lines = wiz.line_ids.sorted(key=lambda l: (l.invoice_date or l.move_id.invoice_date or False, l.name or ""))
-            for credit_line in wiz.unreconciled_payment_line_ids:
-                aml = credit_line.aml_id
-                if not aml or aml.reconciled:
-                    continue
-                for inv_line in inv_lines:
-                    move = inv_line.move_id
-                    if move.state != 'posted':
-                        continue
-                    if hasattr(inv_line, "amount_to_pay") and (not inv_line.amount_to_pay or inv_line.amount_to_pay <= 0):
-                        continue
-                    try:
-                        move.js_assign_outstanding_line(aml.id)
-                    except Exception:
-                        self.env.cr.rollback()
-                        continue
-                    aml.invalidate_cache()
-                    aml.refresh()
-                    if getattr(aml, "reconciled", False):
-                        break
-        return {'type': 'ir.actions.client', 'tag': 'display_notification', 'params': {'title': _('Credits Applied'), 'message': _('Outstanding credits/payments were applied to available invoices.'), 'type': 'success'}}
+            with wiz._perf_phase("credit search") as phase:
+                credits, invoices = wiz._get_selected_credits(), wiz._get_credit_invoices()
+                phase.line_count = len(credits)
+            wiz_applied, wiz_failed = wiz._apply_credits(credits, invoices)
+            applied += wiz_applied
+            failed += wiz_failed
+        if failed:
+            message = _("%(applied)s credit assignments were applied, %(failed)s could not be reconciled.",
+                        applied=applied, failed=failed)
+        else:
+            message = _('Outstanding credits/payments were applied to available invoices.')
+        return {'type': 'ir.actions.client', 'tag': 'display_notification', 'params': {'title': _('Credits Applied'), 'message': message, 'type': 'warning' if failed else 'success'}}
 
+    def action_apply_selected_payments_async(self):
+        """Snapshot the credits and invoices into a background job processed by ir.cron."""
+        self.ensure_one()
+        credits = self._get_selected_credits()
+        if not credits:
+            raise UserError(_("There are no outstanding credits/payments to apply."))
+        job = self.env["batch.payment.allocation.job"].create(dict(
+            self._prepare_job_vals(),
+            job_type="apply_credits",
+            invoice_move_ids=[(6, 0, self._get_credit_invoices().ids)],
+            line_ids=[(0, 0, {"aml_id": aml.id}) for aml in credits],
+        ))
+        return job._action_open()
 
 class BatchPaymentUnreconciledLine(models.TransientModel):
     _name = "batch.payment.unreconciled.line"
@@ -83,16 +253,6 @@ class BatchPaymentUnreconciledLine(models.TransientModel):
     currency_id = fields.Many2one("res.currency", string="Currency", readonly=True)
     company_currency_id = fields.Many2one("res.currency", string="Company Currency", readonly=True)
 
-    available_company = fields.Monetary(string="Available (Company)", currency_field="company_currency_id", compute="_compute_available", store=False, readonly=True)
-    available_currency = fields.Monetary(string="Available", currency_field="currency_id", compute="_compute_available", store=False, readonly=True)
-
-    @api.depends("aml_id")
-    def _compute_available(self):
-        for rec in self:
-            aml = rec.aml_id
-            if not aml:
-                rec.available_company = 0.0
-                rec.available_currency = 0.0
-                continue
-            rec.available_company = abs(aml.amount_residual)
-            rec.available_currency = abs(aml.amount_residual_currency) if aml.currency_id else rec.available_company
+    # Filled when the line is created so rendering never re-reads the journal items
+    available_company = fields.Monetary(string="Available (Company)", currency_field="company_currency_id", readonly=True)
+    available_currency = fields.Monetary(string="Available", currency_field="currency_id", readonly=True)